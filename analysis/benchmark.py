@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import re
+import time
+from datetime import date
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from tables import years_shown, prepare_table, group_data
+from compare import shared_counterparties
+from charts import chart_series, make_line_chart
+
+"""
+OBJECTIVE:
+Times the app's table preparation, filer comparison and comparison charts on synthetic filers shaped like filter_data and filter_aggregates output,
+against the implementations they replaced
+Run from the repo root: python analysis/benchmark.py --rows 10000 100000 1000000 --results analysis/benchmark.json
+With --results, timings are compared to the ones saved by the previous run and functions that got slower are flagged
+"""
+
+contribs = ['Contribution', 'Contributor', 'contribs']
+
+
+
+def make_filer_data(rows, filername='Doe, Jane', seed=0):
+    # One filer's contributions over the years shown, a few thousand contributors repeated over many rows
+    rng = np.random.default_rng(seed)
+    names = np.array([f'Smith, Ann {i}' for i in range(5000)] + ['Acme Llc'], dtype=object)
+    employers = np.array([f'Employer {i}' for i in range(500)] + [''] * 500, dtype=object)
+    locations = np.array([f'City {i},  Tx {78700 + i}, Usa' for i in range(300)], dtype=object)
+    start = np.datetime64(f'{date.today().year - years_shown}-01-01')
+    dates = start + rng.integers(0, 365 * years_shown, rows).astype('timedelta64[D]')
+    data = pd.DataFrame({
+        'Report Info Ident': rng.integers(100000000, 110000000, rows),
+        'Filer Ident': '00012345',
+        'Contributor Law Firm Name': np.nan,
+        'Filer Name': filername,
+        'Contributor Name': names[rng.zipf(1.3, rows) % len(names)],
+        'Contributor Employer': employers[rng.integers(0, len(employers), rows)],
+        'Record Type': 'Rcpt',
+        'Info Only Flag': 'N',
+        'Received Dt': pd.to_datetime(dates + 7),
+        'Contribution Dt': pd.to_datetime(dates),
+        'Contribution Amount': rng.exponential(300, rows).round(2),
+        'Contributor Persent Type': rng.choice(['Individual', 'Entity'], rows),
+        'Contribution Descr': '',
+        'Contributor Location': locations[rng.integers(0, len(locations), rows)],
+    })
+    data['year'] = data['Contribution Dt'].dt.year
+    return data
+
+
+
+def make_counterparties(data, prefix='Contributor'):
+    # Same table as the ETL's {var}_{id}_counterparties files, as loaded by filter_aggregates
+    keys = [col for col in data.columns if prefix in col]
+    return data.fillna({col: '' for col in keys}).groupby(['Filer Name', 'year', *keys])['Contribution Amount'].agg(['sum', 'size', 'max']).reset_index()\
+        .rename(columns={'sum': 'Amount', 'size': 'Count', 'max': 'Max Amount'})
+
+
+
+def make_monthly(filers, years, seed=0):
+    # Monthly totals of filers over years, as get_var_totals passes them to the comparison chart
+    rng = np.random.default_rng(seed)
+    months = pd.date_range(end=pd.Timestamp.today(), periods=12 * years, freq='M')
+    return pd.DataFrame({
+        'Filer Name': np.repeat([f'Doe, Jane {i} (PAC)' for i in range(filers)], len(months)),
+        'Contribution Dt': np.tile(months, filers),
+        'Contribution Amount': rng.exponential(10000, filers * len(months)),
+    })
+
+
+
+def legacy_make_line_chart(data):
+    # Comparison chart before charts.make_line_chart: every month of every filer in the spec, pivoted by Vega for the tooltips
+    name_col, date_col, value_col = data.columns[:3]
+    data[value_col] = data[value_col].astype(float).round(1)
+    data[name_col] = data[name_col].apply(lambda x: x.replace(',', '').replace('.', ' ')).apply(lambda x: re.sub("([\(\[]).*?([\)\]])", "", x))
+    base = alt.Chart(data).encode(x=alt.X(date_col, axis=alt.Axis(format=("%b %Y"))))
+    names = sorted(data[name_col].unique())
+    tooltips = [alt.Tooltip(c, type='quantitative', title=c, format="$,.2f") for c in names]
+    tooltips.insert(0, alt.Tooltip(date_col, title=date_col))
+    selection = alt.selection_single(fields=[date_col], nearest=True, on='mouseover', empty='none', clear='mouseout')
+    lines = base.mark_line(interpolate='catmull-rom').encode(y=alt.Y(value_col, title='', axis=alt.Axis(format="$~s")), color=alt.Color(name_col, legend=alt.Legend()))
+    points = lines.mark_point().transform_filter(selection)
+    rule = base.transform_pivot(pivot=name_col, value=value_col, groupby=[date_col]).mark_rule().encode(
+        opacity=alt.condition(selection, alt.value(0.3), alt.value(0)), tooltip=tooltips).add_selection(selection)
+    return lines + points + rule
+
+
+
+def legacy_chart_spec(monthly):
+    return legacy_make_line_chart(monthly).to_json()
+
+
+
+def chart_spec(monthly):
+    chart_data, date_format, title = chart_series(monthly, 'Contribution Dt', 'Contribution Amount')
+    return make_line_chart(chart_data, date_format, value_col='Contribution Amount').to_json()
+
+
+
+def legacy_prepare_table(filtered_data, var, prefix):
+    # Row-by-row date formatting used before prepare_table
+    for col in [f'{var} Dt', 'Received Dt']:
+        filtered_data[col] = pd.to_datetime(filtered_data[col])
+        filtered_data = filtered_data[filtered_data[col].isna() == False]
+
+    date_min, date_max = filtered_data[f'{var} Dt'].min().strftime(format='%b %d, %Y'), filtered_data[f'{var} Dt'].max().strftime(format='%b %d, %Y')
+
+    for col in [f'{var} Dt', 'Received Dt']:
+        filtered_data[col] = filtered_data[col].apply(lambda x: x.strftime(format='%Y-%m-%d'))
+
+    for col in [col for col in filtered_data.columns if prefix in col]:
+        filtered_data[col] = filtered_data[col].fillna('')
+    return filtered_data.drop(columns=['year']), date_min, date_max
+
+
+
+def legacy_drop_empty(data):
+    # Empty col detection with one unique() per col, used before tables.empty_cols
+    for col in data.columns:
+        if list(data[col].unique()) == ['']:
+            data = data.drop(columns=[col])
+    return data
+
+
+
+def legacy_group_data(var, prefix, counterparties):
+    counterparties = counterparties.fillna('')
+    counterparties = counterparties[counterparties.year >= date.today().year - years_shown]
+    counterparties = legacy_drop_empty(counterparties)
+    return group_data(var, prefix, counterparties)
+
+
+
+def legacy_get_common(concat_dfs, dtype):
+    # Shared counterparties from the filers' concatenated transactions, used before compare.shared_counterparties
+    var, prefix = dtype[0], dtype[1]
+    grouped = concat_dfs.fillna('').groupby([col for col in concat_dfs.columns if prefix.lower() in col.lower() or col == 'Filer Name' or col == 'year'])[f'{var} Amount'].sum().reset_index()
+    name_cols = list(grouped['Filer Name'].unique())
+    common = grouped.pivot(index=[col for col in concat_dfs.columns if prefix.lower() in col.lower() or col == 'year'], columns='Filer Name', values=f'{var} Amount').reset_index()
+    common.rename(columns={'year': 'Year'}, inplace=True)
+    for col in name_cols:
+        common = common[common[col].isna() == False]
+    common = legacy_drop_empty(common)
+    common.reset_index(drop=True, inplace=True)
+    common.sort_values('Year', ascending=False, inplace=True)
+    return common
+
+
+
+def timed(func, *args, repeat=3):
+    # Best of repeat runs, each on fresh copies of the df args since some implementations modify them
+    best = None
+    for _ in range(repeat):
+        copies = [arg.copy() if isinstance(arg, pd.DataFrame) else arg for arg in args]
+        start = time.perf_counter()
+        func(*copies)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+
+def bench(rows, compared=[3, 10]):
+    """
+    Returns {function: seconds} for the current implementations on a synthetic filer with rows transactions
+    (split among filers for the comparison), printing them next to the legacy implementations.
+    """
+    data = make_filer_data(rows)
+    counterparties = make_counterparties(data)
+    cases = [
+        ('prepare_table', legacy_prepare_table, (data, contribs[0], contribs[1]), prepare_table, (data, contribs[0], contribs[1])),
+        ('group_data', legacy_group_data, (contribs[0], contribs[1], counterparties), group_data, (contribs[0], contribs[1], counterparties)),
+    ]
+    for filers in compared:
+        # Filers sharing contributors: the legacy comparison works on their transactions, the current one on their counterparty aggregates
+        filer_data = [make_filer_data(rows // filers, f'Filer {i}', seed=i) for i in range(filers)]
+        cases.append((f'shared_counterparties ({filers} filers)', legacy_get_common, (pd.concat(filer_data), contribs),
+            shared_counterparties, ([make_counterparties(data) for data in filer_data], contribs)))
+        # Comparison chart spec over 25 years, which does not depend on rows
+        monthly = make_monthly(filers, 25)
+        cases.append((f'line chart spec ({filers} filers, 25 years)', legacy_chart_spec, (monthly,), chart_spec, (monthly,)))
+        print(f'line chart spec ({filers} filers, 25 years): legacy {len(legacy_chart_spec(monthly.copy())) / 1024:,.0f} KB, ' + \
+            f'current {len(chart_spec(monthly)) / 1024:,.0f} KB')
+
+    timings = {}
+    for name, legacy, legacy_args, current, args in cases:
+        legacy_seconds, timings[name] = timed(legacy, *legacy_args), timed(current, *args)
+        print(f'{name} ({rows:,} rows): legacy {legacy_seconds:.3f}s, current {timings[name]:.3f}s, speedup {legacy_seconds / timings[name]:.1f}x')
+    return timings
+
+
+
+def compare_results(previous, results, tolerance):
+    # Flags functions slower than tolerance times their previous timing at the same row count
+    regressions = 0
+    for rows, timings in results.items():
+        for name, seconds in timings.items():
+            before = previous.get(rows, {}).get(name)
+            if before is not None and seconds > before * tolerance:
+                regressions += 1
+                print(f'REGRESSION {name} ({int(rows):,} rows): {before:.3f}s -> {seconds:.3f}s')
+    return regressions
+
+
+
+def main(args):
+    results = {str(rows): bench(rows) for rows in args.rows}
+    if args.results:
+        if os.path.exists(args.results):
+            with open(args.results) as f:
+                regressions = compare_results(json.load(f), results, args.tolerance)
+            print(f'{regressions} regressions against {args.results}')
+        with open(args.results, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the app's table preparation on synthetic filers")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--results', help='JSON file of timings from the previous run to compare against, overwritten with this run\'s timings')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='Slowdown ratio reported as a regression')
+    main(parser.parse_args())
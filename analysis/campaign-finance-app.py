@@ -1,10 +1,22 @@
+import json
+import os
 import pandas as pd
 import re
+import sys
+from bisect import bisect_left
 from csv import reader
-import altair as alt
 import streamlit as st
 from pandas.api.types import is_numeric_dtype
-from urllib import request
+
+import data_access
+from data_access import data_url
+from tables import prepare_table, group_data
+from compare import shared_counterparties
+from charts import chart_series, make_line_chart
+
+# The filer index is built like the ETL's when filers_index.json is unavailable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl'))
+from filer_index import make_filer_index
 
 # Page settings
 st.set_page_config(
@@ -58,6 +70,58 @@ dtypes = [contribs, expend, loans]
 
 
 
+def balance_files(ids):
+    return [(f'balance/balance_{id}', True, {'dtype': {'filer_ident': str}, 'parse_dates': ['received_dt']}) for id in ids]
+
+
+
+# Date cols of the ETL's balance/balance_summary (latest and previous balance of each filer)
+summary_dates = ['received_dt', 'previous_received_dt']
+
+
+
+def date_cols(dtype):
+    var = dtype[0]
+    vardt = 'expend' if var == 'Expenditure' else var
+    return [f'{vardt.lower()}_dt', 'received_dt']
+
+
+
+def data_files(ids, dtype, suffix='_view'):
+    # Parquet copies already have datetime and float dtypes, so no CSV parsing or date inference is needed
+    # _view files leave out the filer and office cols that filter_data drops
+    var_short = dtype[2]
+    return [(f'{var_short}/{var_short}_{id}{suffix}', True, {'low_memory': False, 'parse_dates': date_cols(dtype)}) for id in ids]
+
+
+
+def aggregate_files(ids, dtype, kind):
+    var_short = dtype[2]
+    return [(f'{var_short}/{var_short}_{id}_{kind}', False, {'dtype': {'filer_ident': str}, 'parse_dates': ['month'] if kind == 'monthly' else None}) for id in ids]
+
+
+
+def concat_files(files):
+    # Missing files (ids without data) are skipped; raises ValueError if none exist
+    return pd.concat([frame for frame in data_access.fetch_many(files) if frame is not None])
+
+
+
+def prefetch_filers(index, filernames):
+    # Downloads the aggregate files of the selected filers concurrently, so the per-filer loaders below read from the cache
+    # (balance and transactions are only fetched once their table is opened). Store queries are local, so nothing is prefetched
+    if data_access.store_path:
+        return
+    files = []
+    for filername in filernames:
+        ids = index['idents'][index['positions'][filername]]
+        data_ids = partition_ids(index, filername, ids)
+        for dtype in dtypes:
+            files += [file for kind in ['monthly', 'counterparties', 'top'] for file in aggregate_files(data_ids, dtype, kind)]
+    data_access.fetch_many(files)
+
+
+
 def convert_df(df):
      # IMPORTANT: Cache the conversion to prevent computation on every rerun
      return df.to_csv().encode('utf-8')
@@ -65,7 +129,8 @@ def convert_df(df):
 
 
 def display_download_button(data, label, file_name):
-    data_csv = convert_df(data)
+    # data is a df or its already converted csv bytes
+    data_csv = convert_df(data) if isinstance(data, pd.DataFrame) else data
     st.download_button(
         label=label,
         data=data_csv,
@@ -75,9 +140,9 @@ def display_download_button(data, label, file_name):
 
 
 
-@st.cache
+@data_access.cached
 def load_filers():
-    filers = pd.read_csv('https://data-statesman.s3.amazonaws.com/tec-campaign-finance/processed/filers.csv', dtype={'filerIdent': str})
+    filers = pd.read_csv(f'{data_url}/processed/filers.csv', dtype={'filerIdent': str})
     filers.columns = [re.sub( '(?<!^)(?=[A-Z])', ' ', col.replace('Cd', '')).title() for col in filers.columns]
     filers['Filer Filerpers Status'] = filers['Filer Filerpers Status'].str.replace('_', ' ')
 
@@ -85,41 +150,181 @@ def load_filers():
 
 
 
-def filter_balance(ids):
+def fallback_filer_index(filers):
+    # The ETL's index (without partitions) built from load_filers' df, with its raw col names and blanks as ''
+    raw = pd.DataFrame({'filerIdent': filers['Filer Ident'], 'filerPersentTypeCd': filers['Filer Persent Type'], 'filerName': filers['Filer Name']})
+    index = make_filer_index(raw.fillna(''))
+    index['positions'] = {name: i for i, name in enumerate(index['names'])}
+    return index
+
+
+
+@data_access.cached
+def load_filer_index():
+    # Filer name -> idents and filers.csv rows, filer type -> names and name token -> names, built by the ETL
+    # (or from filers.csv for data published before it existed). Fetch errors are raised, so a fallback is not memoized for them
+    content = data_access.download(f'{data_url}/processed/filers_index.json')
+    if content is None:
+        return fallback_filer_index(load_filers())
+    index = json.loads(content)
+    index['positions'] = {name: i for i, name in enumerate(index['names'])}
+    index['tokens'] = [tuple(token) for token in index['tokens']]
+
+    return index
+
+
+
+def filer_index():
+    # load_filer_index, or the fallback for this run only if fetching the index failed
     try:
-        balance = pd.concat([pd.read_csv(f'https://data-statesman.s3.amazonaws.com/tec-campaign-finance/processed/balance/balance_{id}.csv', dtype={'filer_ident': str}, parse_dates=['received_dt']) for id in ids])
-        balance.columns = [col.replace('_', ' ').title() for col in balance.columns]
+        return load_filer_index()
+    except:
+        return fallback_filer_index(load_filers())
+
+
+
+def partition_ids(index, filername, ids):
+    # Ids whose exported rows carry filername, the only ones filter_data keeps rows of (all ids if the index has no partitions)
+    partitions = index.get('partitions', {})
+    return [id for id in ids if partitions.get(id, filername.lower()) == filername.lower()]
+
+
 
-        return balance
+def search_filers(index, query, candidates):
+    # Positions among candidates of the names with a word starting with each word of query
+    matches = set(candidates)
+    for word in re.findall('[a-z0-9]+', query.lower()):
+        tokens = index['tokens']
+        start, stop = bisect_left(tokens, (word,)), bisect_left(tokens, (word + '\uffff',))
+        matches &= {i for token, i in tokens[start:stop]}
+
+    return sorted(matches)
+
+
+
+def load_balance(ids):
+    # Returns an empty df if no filer of ids has a balance file; fetch and query errors are raised, so balance_csv does not memoize them
+    if data_access.store_path:
+        balance = data_access.query('balance', ids, ['received_dt', 'period_start_dt', 'period_end_dt'])
+    else:
+        frames = [frame for frame in data_access.fetch_many(balance_files(ids)) if frame is not None]
+        if not frames:
+            return pd.DataFrame()
+        balance = pd.concat(frames)
+    balance.columns = [col.replace('_', ' ').title() for col in balance.columns]
+
+    return balance
+
+
+
+def filter_balance(ids):
+    # load_balance for display, with an empty df if loading fails
+    try:
+        return load_balance(ids)
     except:
         return pd.DataFrame()
 
 
 
+@data_access.cached
+def load_balance_summary():
+    # One row per filer, so the balance metric of any filer is a lookup; None for data published before the summary existed
+    summary = data_access.fetch('balance/balance_summary', dtype={'filer_ident': str}, parse_dates=summary_dates)
+    return summary.set_index('filer_ident') if summary is not None else None
+
+
+
+def filer_balance(ids):
+    # Latest balance, its date and the previous report's balance of the first of ids with reports, None if none has any
+    try:
+        if data_access.store_path:
+            summary = data_access.query('balance_summary', ids, summary_dates).set_index('filer_ident')
+        else:
+            summary = load_balance_summary()
+    except:
+        summary = None
+
+    if summary is not None:
+        ids = [id for id in ids if id in summary.index]
+        return summary.loc[ids[0]] if ids else None
+
+    # Older data: top two rows of the first filer's balance file
+    balance = filter_balance(ids)
+    if len(balance) == 0:
+        return None
+    balance = balance[balance['Filer Ident'] == balance['Filer Ident'].iloc[0]]
+    return pd.Series({'received_dt': balance['Received Dt'].iloc[0], 'balance': balance['Balance'].iloc[0],
+        'previous_balance': balance['Balance'].iloc[1] if len(balance) > 1 else float('nan')})
+
+
+
 def filter_data(ids, filername, dtype):
 
     # Load dtype vars
-    var, prefix, var_short = dtype[0], dtype[1], dtype[2]
+    var = dtype[0]
 
-    # Filter data
-    if var == 'Expenditure':
-        vardt = 'expend'
+    # Filter data, falling back to the full per-filer files for data published before the _view files existed
+    # Returns [] if the filer has no files; fetch and query errors are raised, so callers do not mistake them for a filer without data
+    if data_access.store_path:
+        data = data_access.query(dtype[2], ids, date_cols(dtype))
     else:
-        vardt = var
+        views = data_access.fetch_many(data_files(ids, dtype))
+        full = data_access.fetch_many(data_files([id for id, view in zip(ids, views) if view is None], dtype, suffix=''))
+        frames = [frame for frame in views + full if frame is not None]
+        if not frames:
+            return []
+        data = pd.concat(frames)
+    data.columns = data.columns.str.replace('_', ' ').str.title().str.replace('Expend', 'Expenditure')
+    filtered_data = data[data['Filer Name'].str.lower() == filername.lower()]
+    filtered_data['year'] = filtered_data[f'{var} Dt'].dt.year
+    filtered_data = filtered_data[[
+        col for col in filtered_data.columns if ('Filer' not in col or col in ['Filer Ident', 'Filer Name']) and 'Office' not in col
+        ]]
+    return filtered_data
+
+
+
+def make_aggregates(filtered_data, var, prefix):
+    # Same tables as the ETL's per-filer aggregates, for filers whose aggregate files are not available yet
+    data = filtered_data.assign(Month=filtered_data[f'{var} Dt'] + pd.offsets.MonthEnd(0))
+    keys = [col for col in data.columns if prefix in col]
+    monthly = data.groupby(['Filer Name', 'year', 'Month'])[f'{var} Amount'].agg(['sum', 'count']).reset_index()\
+        .rename(columns={'sum': 'Amount', 'count': 'Count'})
+    counterparties = data.fillna({col: '' for col in keys}).groupby(['Filer Name', 'year', *keys])[f'{var} Amount'].agg(['sum', 'size', 'max']).reset_index()\
+        .rename(columns={'sum': 'Amount', 'size': 'Count', 'max': 'Max Amount'})
+    top = counterparties.sort_values('Max Amount', ascending=False).groupby('year').head(10)
+
+    return {'monthly': monthly, 'counterparties': counterparties, 'top': top}
+
+
+
+def filter_aggregates(ids, filername, dtype):
+    """
+    Loads the ETL's per-filer aggregates (monthly totals, yearly totals per counterparty, top counterparties per year) for a filer's ids,
+    falling back to computing them from the filer's transactions.
+    """
+
+    var, prefix = dtype[0], dtype[1]
+
+    aggregates = {}
     try:
-        data = pd.concat([
-            pd.read_csv(f'https://data-statesman.s3.amazonaws.com/tec-campaign-finance/processed/{var_short}/{var_short}_{id}.csv', 
-            low_memory=False, parse_dates=[f'{vardt.lower()}_dt', 'received_dt']) for id in ids
-        ])
-        data.columns = data.columns.str.replace('_', ' ').str.title().str.replace('Expend', 'Expenditure')
-        filtered_data = data[data['Filer Name'].str.lower() == filername.lower()]
-        filtered_data['year'] = filtered_data[f'{var} Dt'].dt.year
-        filtered_data = filtered_data[[
-            col for col in filtered_data.columns if ('Filer' not in col or col in ['Filer Ident', 'Filer Name']) and 'Office' not in col
-            ]]
-        return filtered_data
+        for kind in ['monthly', 'counterparties', 'top']:
+            if data_access.store_path:
+                data = data_access.query(f'{dtype[2]}_{kind}', ids, ['month'] if kind == 'monthly' else [])
+            else:
+                data = concat_files(aggregate_files(ids, dtype, kind))
+            data.columns = data.columns.str.replace('_', ' ').str.title().str.replace('Expend', 'Expenditure')
+            data = data[data['Filer Name'].str.lower() == filername.lower()].rename(columns={'Year': 'year'})
+            aggregates[kind] = data[[col for col in data.columns if col != 'Filer Ident']]
+        return aggregates
     except:
-        return []
+        try:
+            filtered_data = filter_data(ids, filername, dtype)
+        except:
+            filtered_data = []
+        if len(filtered_data) > 0:
+            return make_aggregates(filtered_data, var, prefix)
+        return {kind: pd.DataFrame() for kind in ['monthly', 'counterparties', 'top']}
 
 
 
@@ -132,26 +337,39 @@ def display_filertable(filertable):
 
 
 
-def display_balance_stats(filtered_balance):
-    if len(filtered_balance) > 0:
-        # Display balance stats
-        last_balance_amount = round(filtered_balance.iloc[0]['Balance'])
-        prev_balance_amount = round(filtered_balance.iloc[1]['Balance'])
-        balance_diff = round(last_balance_amount - prev_balance_amount)
-        last_balance_date = filtered_balance.iloc[0]['Received Dt'].strftime('%b %d, %Y')
+def display_balance_stats(latest_balance):
+    if latest_balance is not None:
+        # Display balance stats (no delta for filers with a single report)
+        last_balance_amount = round(latest_balance['balance'])
+        balance_diff = None
+        if pd.notna(latest_balance['previous_balance']):
+            balance_diff = '{:,}'.format(round(last_balance_amount - round(latest_balance['previous_balance'])))
+        last_balance_date = latest_balance['received_dt'].strftime('%b %d, %Y')
         
         # Display balance stats
-        st.metric(label=f"Latest Balance (filed on {last_balance_date})", value='${:,}'.format(last_balance_amount), delta='{:,}'.format(balance_diff))
+        st.metric(label=f"Latest Balance (filed on {last_balance_date})", value='${:,}'.format(last_balance_amount), delta=balance_diff)
+
+
+
+@data_access.cached
+def balance_csv(ids):
+    return convert_df(load_balance(list(ids)))
 
 
 
-def display_balance_data(filername, filtered_balance):
-    if len(filtered_balance) > 0:
+def display_balance_data(filername, ids, latest_balance):
+    # The balance files are only loaded once the table is shown
+    if latest_balance is not None:
         with st.expander(f'Balance'):
             st.info('Balance is calculated as: (Total Contributions + Total Unitemized Contributions + Total Contributions Mantained + Total Interest & Income Earned) \
             - (Total Expenditures + Total Unitemized Expenditures + Total Outstanding Loans + Total Unitemized Loans)')
-            display_download_button(filtered_balance, f"Download balance data", f"balance_{filername}.csv")
-            st.dataframe(filtered_balance)
+            if st.checkbox('Show balance table', key=f'{filername}-Balance'):
+                try:
+                    display_download_button(balance_csv(tuple(ids)), f"Download balance data", f"balance_{filername}.csv")
+                except:
+                    st.warning('Could not load balance data, please try again later')
+                    return
+                st.dataframe(filter_balance(ids))
     else:
         st.warning('No balance data to display')
 
@@ -160,16 +378,17 @@ def display_balance_data(filername, filtered_balance):
 def display_stats(dtype):
 
     # Load dtype vars
-    var, prefix, filtered_data = dtype[0], dtype[1], dtype[3]
+    var, prefix, aggregates = dtype[0], dtype[1], dtype[3]
+    monthly, top = aggregates['monthly'], aggregates['top']
 
-    if len(filtered_data) > 0:
+    if len(monthly) > 0:
 
         # Get stats
-        this_year = filtered_data.year.max()
+        this_year = monthly.year.max()
 
-        if this_year - 1 in filtered_data.year.unique():
-            monthly = filtered_data.groupby([pd.Grouper(key=f'{var} Dt', freq='M'), 'year'])\
-                            .agg(amount = (f'{var} Amount', 'sum'), count = (f'{var} Amount', 'count')).reset_index().fillna(0)
+        if this_year - 1 in monthly.year.unique():
+            monthly = monthly.groupby([pd.Grouper(key='Month', freq='M'), 'year'])\
+                            .agg(amount = ('Amount', 'sum'), count = ('Count', 'sum')).reset_index().fillna(0)
 
             avg_amount_this_year = round(monthly[monthly.year == this_year]['amount'].mean())
             avg_amount_last_year = round(monthly[monthly.year == this_year - 1]['amount'].mean())
@@ -179,7 +398,7 @@ def display_stats(dtype):
             avg_count_last_year = round(monthly[monthly.year == this_year - 1]['count'].mean())
             avg_count_diff = round(avg_count_this_year - avg_count_last_year)
 
-            top_contrib_this_year = filtered_data[filtered_data.year == this_year].sort_values(f'{var} Amount', ascending=False).iloc[0]
+            top_contrib_this_year = top[top.year == this_year].sort_values('Max Amount', ascending=False).iloc[0]
             top_contrib_this_year_name = top_contrib_this_year[f'{prefix} Name']
             top_contrib_this_year_info = 'Located in ' + str(top_contrib_this_year[f'{prefix} Location'])
             try:
@@ -198,71 +417,70 @@ def display_stats(dtype):
 
 
 
-def group_data(var, prefix, filtered_data):
-    filtered_data.fillna('', inplace=True)
-    filtered_data[f'{var} Dt'] = pd.to_datetime(filtered_data[f'{var} Dt'])
-    filtered_data = filtered_data[filtered_data[f'{var} Dt'].dt.year >= 2017]
+@data_access.cached
+def detail_tables(ids, filername, dtype):
+    """
+    Builds a filer's formatted data table and unique counterparties pivot for dtype, with their download payloads.
+    Memoized per filer and dtype and only called once the user opens the tables. Returns None if the filer has no data;
+    loading errors are raised instead, so they are not memoized and the next rerun tries again.
+    """
 
-    for col in filtered_data.columns:
-        if list(filtered_data[col].unique()) == ['']:
-            filtered_data.drop(columns=[col], inplace=True)
-    grouped = filtered_data.groupby([col for col in filtered_data.columns if prefix in col or col == 'year'])\
-    .agg(count = ('Report Info Ident', 'count'), amount = (f'{var} Amount', 'sum'))\
-    .reset_index()\
-    .rename(columns={'count': var + 's', 'amount':f'{var} Amount' })\
-    .pivot(index=[col for col in filtered_data.columns if prefix in col], columns='year', values=[f'{var} Amount', var + 's'])\
-    .fillna(0)
+    var, prefix = dtype[0], dtype[1]
+    filtered_data = filter_data(list(ids), filername, dtype)
+    if len(filtered_data) == 0:
+        return None
 
-    if len(grouped) > 0:
-        grouped.sort_values(grouped.columns[-1], ascending=False, inplace=True)
+    count = len(filtered_data)
+    grouped_data = group_data(var, prefix, filter_aggregates(list(ids), filername, dtype)['counterparties'])
+    filtered_data, date_min, date_max = prepare_table(filtered_data, var, prefix)
 
-    return grouped
+    return {
+        'count': count, 'date_min': date_min, 'date_max': date_max,
+        'table': filtered_data.fillna(''), 'table_csv': convert_df(filtered_data),
+        'grouped': grouped_data, 'grouped_csv': convert_df(grouped_data.reset_index().reset_index(drop=True))
+    }
 
 
 
-def display_data(dtype, filername):
+def display_data(dtype, filername, ids):
 
     # Load dtype vars
-    var, prefix, var_short, filtered_data = dtype[0], dtype[1], dtype[2], dtype[3]
+    var, prefix, monthly = dtype[0], dtype[1], dtype[3]['monthly']
 
     # Display data table
-    if len(filtered_data) > 0:
-        count = len(filtered_data)
-        count_str = '{:,}'.format(count)
-
-        grouped_data = group_data(var, prefix, filtered_data)
-        grouped_count = len(grouped_data)
-        grouped_count_str = '{:,}'.format(grouped_count)
-
-        for col in [f'{var} Dt', 'Received Dt']:
-            filtered_data[col] = pd.to_datetime(filtered_data[col])
-            filtered_data = filtered_data[filtered_data[col].isna() == False]
-
-        date_min, date_max = filtered_data[f'{var} Dt'].min().strftime(format='%b %d, %Y'), filtered_data[f'{var} Dt'].max().strftime(format='%b %d, %Y')
-
-        for col in [f'{var} Dt', 'Received Dt']:
-            filtered_data[col] = filtered_data[col].apply(lambda x: x.strftime(format='%Y-%m-%d'))
-
-        for col in [col for col in filtered_data.columns if prefix in col]:
-            filtered_data[col] = filtered_data[col].fillna('')
+    if len(monthly) > 0:
         with st.expander(f'{var}s'):
+            if not st.checkbox(f'Show {var.lower()} tables', key=f'{filername}-{var}'):
+                return
+            try:
+                tables = detail_tables(tuple(ids), filername, tuple(dtype[:3]))
+            except:
+                st.warning(f'Could not load {var.lower()} data, please try again later')
+                return
+            if tables is None:
+                st.warning(f'No {var.lower()} data to display')
+                return
+
+            count_str = '{:,}'.format(tables['count'])
+            grouped_count_str = '{:,}'.format(len(tables['grouped']))
+            date_min, date_max = tables['date_min'], tables['date_max']
 
             # Data
             st.markdown(f'**All {var}s**')
             if date_min != date_max:
                 st.markdown(f'{count_str} {var.lower()}s between {date_min} and {date_max}')
-            elif count == 1:
+            elif tables['count'] == 1:
                 st.markdown(f'{count_str} {var.lower()} on {date_min}')
             else:
                 st.markdown(f'{count_str} {var.lower()}s on {date_min}')
-            display_download_button(filtered_data.drop(columns=['year']), f"Download {var.lower()} data", f"data_{var.lower()}_{filername}.csv")
-            st.dataframe(filtered_data.fillna('').drop(columns=['year']))
+            display_download_button(tables['table_csv'], f"Download {var.lower()} data", f"data_{var.lower()}_{filername}.csv")
+            st.dataframe(tables['table'])
 
             # Grouped data
             st.markdown(f'**Unique {prefix}s**')
             st.markdown(f'{grouped_count_str} unique {prefix.lower()}s')
-            display_download_button(grouped_data.reset_index().reset_index(drop=True), f"Download unique {prefix.lower()}s data", f"{prefix.lower()}_{filername}.csv")
-            st.dataframe(grouped_data)
+            display_download_button(tables['grouped_csv'], f"Download unique {prefix.lower()}s data", f"{prefix.lower()}_{filername}.csv")
+            st.dataframe(tables['grouped'])
 
 
     else:
@@ -270,37 +488,12 @@ def display_data(dtype, filername):
 
 
 
-def get_common(concat_dfs, dtype):
-
-    var, prefix = dtype[0], dtype[1]
-
-    grouped = concat_dfs.fillna('').groupby([col for col in concat_dfs.columns if prefix.lower() in col.lower() or col == 'Filer Name' or col == 'year'])[f'{var} Amount'].sum().reset_index()
-
-    name_cols = list(grouped['Filer Name'].unique())
-
-    common = grouped.pivot(index=[col for col in concat_dfs.columns if prefix.lower() in col.lower() or col == 'year'], columns='Filer Name', values=f'{var} Amount').reset_index()
-    common.rename(columns={'year': 'Year'}, inplace=True)
-
-    for col in name_cols:
-        common = common[common[col].isna() == False]
-
-    for col in common.columns:
-        if list(common[col].unique()) == ['']:
-            common.drop(columns=[col], inplace=True)
-
-    common.reset_index(drop=True, inplace=True)
-    common.sort_values('Year', ascending=False, inplace=True)
-
-    return common
-
-
-
-def display_common(concat_dfs, dtype, names):
+def display_common(counterparties_by_filer, dtype, names):
 
     var, prefix = dtype[0], dtype[1]
 
     st.markdown(f'**Shared {prefix}s**')
-    common = get_common(concat_dfs, dtype)
+    common = shared_counterparties(counterparties_by_filer, dtype)
     if len(common) > 0:
         names_forfile = '_'.join(names)
         display_download_button(common, f"Download shared {prefix.lower()}s data", f"shared_{prefix.lower()}s_{names_forfile}.csv")
@@ -310,49 +503,12 @@ def display_common(concat_dfs, dtype, names):
 
 
 
-def make_line_chart(data):
-
-    name_col = data.columns[0]
-    date_col = data.columns[1]
-    value_col = data.columns[2]
-    data[value_col] = data[value_col].astype(float).round(1)
-    data[name_col] = data[name_col].apply(lambda x: x.replace(' ', ' ').replace(',', '').replace('.', ' ')).apply(lambda x: re.sub("([\(\[]).*?([\)\]])", "", x))
-
-    base = alt.Chart(data).encode(
-        x=alt.X(date_col, axis=alt.Axis(format = ("%b %Y")))
-        )
-
-    names = sorted(data[name_col].unique())
-    tooltips = [alt.Tooltip(c, type='quantitative', title=c, format="$,.2f") for c in names]
-    tooltips.insert(0, alt.Tooltip(date_col, title=date_col))
-    selection = alt.selection_single(
-        fields=[date_col], nearest=True, on='mouseover', empty='none', clear='mouseout'
-    )
-
-    lines = base.mark_line(interpolate='catmull-rom').encode(
-        y=alt.Y(value_col, title='', axis=alt.Axis(format="$~s")), 
-        color=alt.Color(name_col, legend=alt.Legend()))
-    points = lines.mark_point().transform_filter(selection)
-
-    rule = base.transform_pivot(
-        pivot=name_col, value=value_col, groupby=[date_col]
-    ).mark_rule().encode(
-        opacity=alt.condition(selection, alt.value(0.3), alt.value(0)),
-        tooltip=tooltips
-    ).add_selection(selection)
-
-    chart = lines + points + rule
-    
-    return chart
-
-
-
-def get_var_totals(concat_dfs, dtype):
+def get_var_totals(concat_monthly, dtype):
 
     var = dtype[0]
 
-    concat_dfs[f'{var} Dt'] = pd.to_datetime(concat_dfs[f'{var} Dt'])
-    grouped = concat_dfs.groupby(['Filer Name', pd.Grouper(key=f'{var} Dt', freq='m')])[f'{var} Amount'].sum().reset_index()
+    grouped = concat_monthly.groupby(['Filer Name', pd.Grouper(key='Month', freq='m')])['Amount'].sum().reset_index()\
+        .rename(columns={'Month': f'{var} Dt', 'Amount': f'{var} Amount'})
     grouped[f'{var} Dt'] = pd.to_datetime(grouped[f'{var} Dt'])
     for_download = grouped.pivot(index=f'{var} Dt', columns='Filer Name', values=f'{var} Amount').reset_index()
 
@@ -360,14 +516,16 @@ def get_var_totals(concat_dfs, dtype):
 
 
 
-def display_var_totals_chart(dtype, concat_dfs, names):
+def display_var_totals_chart(dtype, concat_monthly, names):
 
     var = dtype[0]
     names_forfile = '_'.join(names)
-    chart_data, for_download = get_var_totals(concat_dfs, dtype)
-    chart = make_line_chart(chart_data)
+    monthly, for_download = get_var_totals(concat_monthly, dtype)
+    # Monthly, quarterly or yearly depending on the span and number of filers, so the chart stays small
+    chart_data, date_format, title = chart_series(monthly, f'{var} Dt', f'{var} Amount')
+    chart = make_line_chart(chart_data, date_format, value_col=f'{var} Amount')
 
-    st.markdown(f'**{var} Monthly Totals**')
+    st.markdown(f'**{var} {title} Totals**')
     display_download_button(for_download, f"Download {var.lower()} monthly totals data", f"monthly_totals_{var.lower()}_{names_forfile}.csv")
     st.altair_chart(chart, use_container_width=True)
 
@@ -378,13 +536,23 @@ def display_var_totals_chart(dtype, concat_dfs, names):
 def get_filer_data():
     # Load filers
     filers = load_filers()
+    index = filer_index()
 
     # Display filters
 
     filertypeW = st.multiselect(options=['INDIVIDUAL', 'ENTITY'], 
     label='Select one or more filer types')
 
-    filernameW = st.multiselect(options=list(filers[filers['Filer Persent Type'].isin(filertypeW)]['Filer Name'].unique()), 
+    searchW = st.text_input(label='Search filers by name', help="Type the start of the entity's name or the filer's LAST NAME to narrow the options below")
+
+    # Options are the names of the selected types matching the search, keeping filers already selected
+    candidates = sorted({i for filertype in filertypeW for i in index['types'].get(filertype, [])})
+    if searchW.strip() != '':
+        candidates = search_filers(index, searchW, candidates)
+    selected = [name for name in st.session_state.get('filernames', []) if name in index['positions']]
+    options = selected + [index['names'][i] for i in candidates if index['names'][i] not in selected]
+
+    filernameW = st.multiselect(options=options, key='filernames',
     label='Select one or more filers by name', help="Begin tying the entity's name or the filer's LAST NAME to view options")
 
     if len(filernameW) == 1:
@@ -392,10 +560,15 @@ def get_filer_data():
 
     data = []
 
+    # Fetch all selected filers' files at once
+    with st.spinner('Loading data...'):
+        prefetch_filers(index, filernameW)
+
     # Display filertable
     for filername in filernameW:
 
-        ids = list(filers[filers['Filer Name'] == filername]['Filer Ident'].unique())
+        ids = index['idents'][index['positions'][filername]]
+        data_ids = partition_ids(index, filername, ids)
 
         # Redefining dtypes
         contribs=['Contribution', 'Contributor', 'contribs']
@@ -406,34 +579,33 @@ def get_filer_data():
         # Filter data
         with st.spinner('Loading data...'):
             for dtype in dtypes:
-                filtered_data = filter_data(ids, filername, dtype)
-                dtype.append(filtered_data) ## dtype format now [var, prefix, varshort, filtered_data]
+                dtype.append(filter_aggregates(data_ids, filername, dtype)) ## dtype format now [var, prefix, varshort, aggregates]
 
         
         # Balance data
-        filtered_balance = filter_balance(ids)
+        latest_balance = filer_balance(ids)
 
         st.markdown(f'### {filername}')
 
         # Display balance stats
-        display_balance_stats(filtered_balance)
+        display_balance_stats(latest_balance)
                 
         # Display stats for each dtype
         for dtype in dtypes:
-            if len(dtype[3]) > 0: # filtered_data is dataframe
-                data.append([dtype[0], dtype[3]])
+            if len(dtype[3]['monthly']) > 0: # filer has data
+                data.append([dtype[0], filername, data_ids, dtype[3]])
                 display_stats(dtype)
 
         # Display filertable
-        filertable = filers[filers['Filer Name'] == filername].reset_index(drop=True).dropna(how='all', axis=1)
+        filertable = filers.iloc[index['rows'][index['positions'][filername]]].reset_index(drop=True).dropna(how='all', axis=1)
         display_filertable(filertable)
 
         # Display balance data
-        display_balance_data(filername, filtered_balance)
+        display_balance_data(filername, ids, latest_balance)
 
         # Display data
         for dtype in dtypes:
-            display_data(dtype, filername)
+            display_data(dtype, filername, data_ids)
 
     
     compare_filers(filernameW, data, filers)
@@ -450,24 +622,24 @@ def compare_filers(filernameW, data, filers):
 
         for dtype in dtypes:
 
-            dfs = [el[1] for el in data if el[0] == dtype[0]]
+            entries = [el for el in data if el[0] == dtype[0]] ## [var, filername, ids, aggregates]
             
 
-            if len(dfs) > 0:
+            if len(entries) > 0:
 
-                concat_dfs = pd.concat(dfs)
+                concat_monthly = pd.concat([el[3]['monthly'] for el in entries])
 
-                if len(concat_dfs) >= 10 and concat_dfs['Filer Name'].nunique() > 1:
+                if concat_monthly['Count'].sum() >= 10 and concat_monthly['Filer Name'].nunique() > 1:
 
                     # Making main vars
-                    names = [re.sub("([\(\[]).*?([\)\]])", "", name.replace(',', '').replace('.', '').replace(' ', '-')).strip() for name in list(concat_dfs['Filer Name'].unique())]
+                    names = [re.sub("([\(\[]).*?([\)\]])", "", name.replace(',', '').replace('.', '').replace(' ', '-')).strip() for name in list(concat_monthly['Filer Name'].unique())]
 
                     with st.expander(f'Compare {dtype[0]}s'):
                         # Display chart
-                        display_var_totals_chart(dtype, concat_dfs, names)
+                        display_var_totals_chart(dtype, concat_monthly, names)
 
                         # Display common
-                        display_common(concat_dfs, dtype, names)
+                        display_common([el[3]['counterparties'] for el in entries], dtype, names)
                 else:
                     st.warning(f'Insufficient data to compare {dtype[0].lower()}s')
             else:
@@ -478,8 +650,8 @@ def main():
     st.image('https://upload.wikimedia.org/wikipedia/commons/d/d9/Austin_American-Statesman_%282019-10-31%29.svg', width=300)
     st.title('Campaign Finance Data Tool')
 
-    with request.urlopen('https://data-statesman.s3.amazonaws.com/tec-campaign-finance/documentation/last_update.txt') as f:
-        last_update = f.read().decode('utf-8')
+    # Checking for a new ETL run first, so everything loaded below is cached under the current stamp
+    last_update = data_access.last_update()
 
     st.markdown(f'##### Last update: {last_update}')
     st.markdown("""
@@ -0,0 +1,80 @@
+import altair as alt
+import pandas as pd
+
+"""
+OBJECTIVE:
+Line charts of the campaign finance app's filer comparison
+Filers' monthly totals are bucketed by month, quarter or year depending on the span compared, so a chart has at most max_values points
+whatever the number of filers or years, and pivoted server-side into one row per bucket and one col per filer, which is the only data
+embedded in the chart spec (lines fold it back client-side instead of pivoting the long data per render)
+"""
+
+# Buckets from finest to coarsest: pandas frequency, axis date format and the word used in chart titles
+buckets = [('M', '%b %Y', 'Monthly'), ('Q', '%b %Y', 'Quarterly'), ('A', '%Y', 'Yearly')]
+# Max points (buckets x filers) of a chart
+max_values = 1500
+
+
+
+def chart_labels(names):
+    # Filer names without commas, periods and bracketed parts, usable as Vega field names; cleaned once per distinct name
+    codes, uniques = pd.factorize(pd.Series(names))
+    labels = pd.Series(uniques, dtype=object).str.replace(',', '', regex=False).str.replace('.', ' ', regex=False)\
+        .str.replace(r'([\(\[]).*?([\)\]])', '', regex=True)
+    return labels.to_numpy()[codes]
+
+
+
+def choose_bucket(start, end, series, max_values=max_values):
+    # Finest bucket keeping buckets x series within max_values, else the coarsest
+    for bucket in buckets:
+        if len(pd.period_range(start, end, freq=bucket[0])) * series <= max_values:
+            return bucket
+    return buckets[-1]
+
+
+
+def chart_series(monthly, date_col, value_col, max_values=max_values):
+    """
+    Given long monthly totals (Filer Name, date_col, value_col), returns the chart's wide df (date_col and one col per filer label,
+    totals of the bucket choose_bucket picks, dated by its last day, NaN outside a filer's months), keeping the most recent
+    max_values // filers buckets, and the bucket's date format and title word.
+    """
+    data = monthly.assign(**{'Filer Name': chart_labels(monthly['Filer Name'])})
+    series = max(data['Filer Name'].nunique(), 1)
+    freq, date_format, title = choose_bucket(data[date_col].min(), data[date_col].max(), series, max_values)
+
+    wide = data.groupby(['Filer Name', pd.Grouper(key=date_col, freq=freq)])[value_col].sum().unstack('Filer Name')
+    wide = wide.sort_index().tail(max(max_values // series, 1)).round(1)
+    wide.columns.name = None
+    return wide.reset_index(), date_format, title
+
+
+
+def make_line_chart(data, date_format='%b %Y', name_col='Filer Name', value_col='Amount'):
+    # Lines and hover points per filer from chart_series' wide df, with a rule showing every filer's value at the hovered date
+    date_col = data.columns[0]
+    names = list(data.columns[1:])
+
+    base = alt.Chart(data).encode(
+        x=alt.X(date_col, axis=alt.Axis(format=date_format))
+        )
+
+    tooltips = [alt.Tooltip(c, type='quantitative', title=c, format="$,.2f") for c in sorted(names)]
+    tooltips.insert(0, alt.Tooltip(date_col, title=date_col))
+    selection = alt.selection_single(
+        fields=[date_col], nearest=True, on='mouseover', empty='none', clear='mouseout'
+    )
+
+    lines = base.transform_fold(names, as_=[name_col, value_col]).transform_filter(f'isValid(datum["{value_col}"])')\
+        .mark_line(interpolate='catmull-rom').encode(
+        y=alt.Y(f'{value_col}:Q', title='', axis=alt.Axis(format="$~s")),
+        color=alt.Color(f'{name_col}:N', legend=alt.Legend(), sort=sorted(names)))
+    points = lines.mark_point().transform_filter(selection)
+
+    rule = base.mark_rule().encode(
+        opacity=alt.condition(selection, alt.value(0.3), alt.value(0)),
+        tooltip=tooltips
+    ).add_selection(selection)
+
+    return lines + points + rule
@@ -0,0 +1,68 @@
+import os
+import sys
+from functools import reduce
+import numpy as np
+import pandas as pd
+
+from tables import empty_cols
+
+# Entity normalization is shared with the ETL
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl'))
+from normalize import normalize_values
+
+"""
+OBJECTIVE:
+Filer comparison engine of the campaign finance app
+Finds the counterparties (contributors, payees, lenders) shared by several filers from each filer's counterparty aggregates
+(yearly totals per counterparty, as exported by the ETL) instead of their transactions.
+Each counterparty and year is reduced to a 64-bit hash of its cols, normalized like the ETL's counterparty index keys (case and spacing),
+so shared counterparties are an intersection of sorted hash arrays and each filer's totals are looked up by hash,
+keeping the cost linear in the filers' counterparties
+"""
+
+
+
+def counterparty_keys(counterparties, keys):
+    # One hash per row of the counterparty cols and year, with blanks, dtypes, case and spacing normalized so equal counterparties hash equally across filers
+    normalized = pd.DataFrame({col: normalize_values(counterparties[col]) for col in keys})
+    normalized['year'] = counterparties['year'].astype('int64')
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+
+
+def yearly_totals(counterparties, hashes):
+    # Filer's total per counterparty and year, indexed by hash (a filer's idents may list the same counterparty)
+    return pd.Series(counterparties['Amount'].to_numpy(), index=hashes).groupby(level=0).sum()
+
+
+
+def shared_counterparties(counterparties_by_filer, dtype):
+    """
+    Given each filer's counterparty aggregates (Filer Name, year, counterparty cols, Amount, ...), returns the counterparties
+    all filers have in the same year: one row per counterparty and year with its cols, Year and each filer's total under the filer's name,
+    latest years first.
+    """
+
+    prefix = dtype[1]
+    counterparties_by_filer = [counterparties for counterparties in counterparties_by_filer if len(counterparties) > 0]
+    if len(counterparties_by_filer) == 0:
+        return pd.DataFrame()
+    keys = [col for col in counterparties_by_filer[0].columns if prefix.lower() in col.lower()]
+
+    hashes = [counterparty_keys(counterparties, keys) for counterparties in counterparties_by_filer]
+    totals = {counterparties['Filer Name'].iloc[0]: yearly_totals(counterparties, filer_hashes) for counterparties, filer_hashes in zip(counterparties_by_filer, hashes)}
+    shared = reduce(np.intersect1d, sorted((filer_totals.index.to_numpy() for filer_totals in totals.values()), key=len))
+
+    # Counterparty cols of the shared keys, taken from the first filer's rows
+    first = counterparties_by_filer[0]
+    mask = np.isin(hashes[0], shared)
+    rows = first[mask].assign(hash=hashes[0][mask]).drop_duplicates('hash')
+    common = rows[keys].fillna('').assign(Year=rows['year'].astype('int64').to_numpy())
+    for name in sorted(totals):
+        common[name] = totals[name].reindex(rows['hash'].to_numpy()).to_numpy()
+
+    common = common.drop(columns=empty_cols(common))
+    sort_cols = [col for col in keys if col in common.columns]
+    common = common.sort_values(['Year', *sort_cols], ascending=[False] + [True] * len(sort_cols))
+
+    return common.reset_index(drop=True)
@@ -0,0 +1,233 @@
+import functools
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+"""
+OBJECTIVE:
+Data access layer of the campaign finance app
+Fetches processed files concurrently over a pooled HTTP session and keeps parsed dfs in a size-bounded LRU cache
+shared by all sessions of the app process, keyed by file and by the ETL's last update stamp.
+The stamp (documentation/last_update.txt) is re-read at most every TEC_VERSION_TTL seconds; when the ETL publishes
+a new one, entries of the previous run are dropped once and every later lookup misses and refetches.
+If TEC_STORE points to the SQLite database written by the ETL's --store option, per-filer tables are queried from it instead,
+each filer's rows being an index range scan
+"""
+
+# Processed data location and preferred format ('parquet' falls back to csv for files without a Parquet copy)
+data_url = os.environ.get('TEC_DATA_URL', 'https://data-statesman.s3.amazonaws.com/tec-campaign-finance')
+data_format = os.environ.get('TEC_DATA_FORMAT', 'parquet')
+store_path = os.environ.get('TEC_STORE')
+
+# Concurrent downloads, cache size and how often to check for a new ETL run
+fetch_workers = int(os.environ.get('TEC_FETCH_WORKERS', 16))
+cache_mb = int(os.environ.get('TEC_CACHE_MB', 512))
+version_ttl = int(os.environ.get('TEC_VERSION_TTL', 60))
+
+
+
+class FrameCache:
+    """
+    Thread-safe LRU cache of dfs, evicting the least recently used entries once their total memory exceeds max_bytes.
+    Keys start with the data version they were loaded for. Each entry also costs entry_bytes for its key and bookkeeping,
+    so cached misses (None) count against max_bytes too and are evicted like any other entry.
+    """
+    entry_bytes = 512
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        # Returns (True, df) on a hit, (False, None) on a miss; missing files are cached as None
+        with self.lock:
+            if key not in self.entries:
+                return False, None
+            self.entries.move_to_end(key)
+            return True, self.entries[key][0]
+
+    def put(self, key, frame):
+        size = value_size(frame) + self.entry_bytes
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (frame, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                self.bytes -= self.entries.popitem(last=False)[1][1]
+
+    def drop_stale(self, version):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] != version]:
+                self.bytes -= self.entries.pop(key)[1]
+
+
+
+def value_size(value):
+    # Memory of a cached df, or of the dfs and payloads in a memoized result
+    if value is None:
+        return 0
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(value_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+
+cache = FrameCache(cache_mb * 1024**2)
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=fetch_workers, pool_maxsize=fetch_workers))
+session.mount('https://', HTTPAdapter(pool_connections=fetch_workers, pool_maxsize=fetch_workers))
+pool = ThreadPoolExecutor(fetch_workers)
+
+# Stamp of the data currently served and when it was last checked
+state = {'version': None, 'checked': 0}
+version_lock = threading.Lock()
+# Store connection of each thread, as sqlite3 connections can only be used by the thread that opened them
+local = threading.local()
+
+
+
+def last_update():
+    """
+    Returns the ETL's last update stamp, fetching it at most every version_ttl seconds across all sessions.
+    A changed stamp invalidates the cache.
+    """
+    with version_lock:
+        if state['version'] is not None and time.monotonic() - state['checked'] < version_ttl:
+            return state['version']
+        response = session.get(f'{data_url}/documentation/last_update.txt', timeout=30)
+        response.raise_for_status()
+        version = response.content.decode('utf-8')
+        state['checked'] = time.monotonic()
+        if version != state['version']:
+            state['version'] = version
+            cache.drop_stale(version)
+        return version
+
+
+
+def download(url):
+    # Returns the file's bytes or None if it does not exist (S3 answers 403 for missing keys of a bucket that cannot be listed)
+    response = session.get(url, timeout=30)
+    if response.status_code in [403, 404]:
+        return None
+    response.raise_for_status()
+    return response.content
+
+
+
+def load(path, parquet, kwargs):
+    frame = None
+    if parquet and data_format == 'parquet':
+        content = download(f'{data_url}/processed/{path}.parquet')
+        if content is not None:
+            frame = pd.read_parquet(BytesIO(content))
+    if frame is None:
+        content = download(f'{data_url}/processed/{path}.csv')
+        if content is not None:
+            frame = pd.read_csv(BytesIO(content), **kwargs)
+    return frame
+
+
+
+def request_key(request):
+    path, parquet, kwargs = request
+    return (state['version'], path, parquet, repr(sorted(kwargs.items())))
+
+
+
+def fetch_many(requests):
+    """
+    Given (path, parquet, read_csv kwargs) requests for processed files (path relative to processed/, without extension),
+    returns their dfs in order (None for missing files), downloading the ones not cached concurrently.
+    """
+    start = time.perf_counter()
+    keys = [request_key(request) for request in requests]
+    frames = [cache.get(key) for key in keys]
+    misses = {key: request for key, request, (hit, frame) in zip(keys, requests, frames) if not hit}
+
+    def timed_load(request):
+        load_start = time.perf_counter()
+        return load(*request), time.perf_counter() - load_start
+
+    loaded, latencies = {}, []
+    for key, (frame, latency) in zip(misses, pool.map(timed_load, misses.values())):
+        cache.put(key, frame)
+        loaded[key] = frame
+        latencies.append(latency)
+
+    frames = [frame if hit else loaded[key] for key, (hit, frame) in zip(keys, frames)]
+    if misses:
+        print(f'Fetched {len(misses):,} files ({len(requests) - len(misses):,} cached) in {time.perf_counter() - start:.2f}s, ' + \
+            f'slowest {max(latencies):.2f}s, cache {cache.bytes / 1024**2:,.1f} MB')
+    return frames
+
+
+
+def fetch(path, parquet=True, **kwargs):
+    return fetch_many([(path, parquet, kwargs)])[0]
+
+
+
+def cached(func):
+    # Memoizes a loader in the shared cache, so its result follows the same versioning and memory limit as fetched files
+    @functools.wraps(func)
+    def wrapper(*args):
+        key = (state['version'], func.__qualname__, args)
+        hit, value = cache.get(key)
+        if not hit:
+            value = func(*args)
+            cache.put(key, value)
+        return value
+    return wrapper
+
+
+
+def store_connection():
+    # Read-only connection of this thread, reopened when the ETL replaces the store file
+    mtime = os.path.getmtime(store_path)
+    if getattr(local, 'mtime', None) != mtime:
+        local.connection = sqlite3.connect(f'file:{store_path}?mode=ro', uri=True)
+        local.mtime = mtime
+    return local.connection, mtime
+
+
+
+def query(table, ids, parse_dates=()):
+    """
+    Returns the rows of filer ids in a store table, ordered like the concatenated per-filer files (by id, then in load order),
+    with the cols in parse_dates parsed from their YYYY-MM-DD strs. Results are cached like fetched files, also keyed by the
+    store's modification time since it can be rebuilt without a new stamp.
+    """
+    start = time.perf_counter()
+    ids = list(dict.fromkeys(ids))
+    connection, mtime = store_connection()
+    key = (state['version'], 'query', mtime, table, tuple(ids))
+    hit, frame = cache.get(key)
+    if hit:
+        return frame
+
+    frame = pd.read_sql_query(f'SELECT * FROM "{table}" WHERE filer_ident IN ({", ".join("?" * len(ids))}) ORDER BY rowid', connection, params=ids)
+    frame = frame.iloc[np.argsort(pd.Categorical(frame.filer_ident, categories=ids).codes, kind='stable')].reset_index(drop=True)
+    for col in parse_dates:
+        frame[col] = pd.to_datetime(frame[col])
+    cache.put(key, frame)
+    print(f'Queried {len(frame):,} {table} rows in {time.perf_counter() - start:.3f}s, cache {cache.bytes / 1024**2:,.1f} MB')
+    return frame
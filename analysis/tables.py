@@ -0,0 +1,64 @@
+from datetime import date
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype
+
+"""
+OBJECTIVE:
+Table preparation for the campaign finance app
+Turns a filer's transactions and counterparty aggregates into the tables the app displays using whole-column pandas operations,
+and has no Streamlit dependency so it can be timed on synthetic data (analysis/benchmark.py)
+"""
+
+# Rolling window of years shown, matching the ETL's --years
+years_shown = 5
+
+
+
+def empty_cols(data):
+    # Cols where every value is '', found with one comparison over the whole df rather than a unique() per col
+    if len(data) == 0:
+        return []
+    return list(data.columns[(data == '').all()])
+
+
+
+def prepare_table(filtered_data, var, prefix):
+    """
+    Formats a filer's transactions for display: drops rows without dates, formats dates as YYYY-MM-DD and fills blank counterparty cols.
+    Returns the formatted df (without the year col) and the first and last transaction dates.
+    """
+    datecols = [f'{var} Dt', 'Received Dt']
+
+    # Dates come parsed from Parquet or read_csv, so converting only cols that did not
+    data = filtered_data.assign(**{col: pd.to_datetime(filtered_data[col]) for col in datecols if not is_datetime64_any_dtype(filtered_data[col])})
+    data = data[data[datecols].notna().all(axis=1)]
+
+    date_min, date_max = data[f'{var} Dt'].min().strftime(format='%b %d, %Y'), data[f'{var} Dt'].max().strftime(format='%b %d, %Y')
+
+    prefix_cols = [col for col in data.columns if prefix in col]
+    # YYYY-MM-DD strs of the dates at day precision, formatted by numpy in one call per col
+    data = data.assign(**{col: np.datetime_as_string(data[col].to_numpy(dtype='datetime64[D]'), unit='D').astype(object) for col in datecols})
+    data[prefix_cols] = data[prefix_cols].fillna('')
+
+    return data.drop(columns=['year']), date_min, date_max
+
+
+
+def group_data(var, prefix, counterparties):
+    counterparties = counterparties.fillna('')
+    counterparties = counterparties[counterparties.year >= date.today().year - years_shown]
+    counterparties = counterparties.drop(columns=empty_cols(counterparties))
+
+    grouped = counterparties.groupby([col for col in counterparties.columns if prefix in col or col == 'year'])\
+    .agg(count = ('Count', 'sum'), amount = ('Amount', 'sum'))\
+    .reset_index()\
+    .rename(columns={'count': var + 's', 'amount':f'{var} Amount' })\
+    .pivot(index=[col for col in counterparties.columns if prefix in col], columns='year', values=[f'{var} Amount', var + 's'])\
+    .fillna(0)
+
+    if len(grouped) > 0:
+        grouped.sort_values(grouped.columns[-1], ascending=False, inplace=True)
+
+    return grouped
+
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+"""
+OBJECTIVE:
+Balance time series of filers from cover.csv
+Computes each report's balance with whole-column arithmetic, keeps one report per filer and received date (amended reports,
+timelyCorrectionFlag Y, replacing the original), and summarizes each filer's latest balance and its change since the previous report.
+Incremental runs only recompute filers whose cover rows changed, found by comparing per-filer hashes of the raw rows with the last run's
+"""
+
+# Report amounts added to or subtracted from the balance
+positive_cols = ['unitemizedContribAmount', 'totalContribAmount', 'contribsMaintainedAmount', 'totalInterestEarnedAmount']
+negative_cols = ['unitemizedExpendAmount', 'totalExpendAmount', 'loanBalanceAmount', 'unitemizedLoanAmount']
+series_cols = ['filerIdent', 'filerName', 'receivedDt', 'periodStartDt', 'periodEndDt', 'balance']
+summary_cols = ['filer_ident', 'filer_name', 'received_dt', 'balance', 'previous_received_dt', 'previous_balance', 'balance_change', 'reports']
+
+
+
+def cover_hashes(cover):
+    # One hash per filer of all its raw cover rows (order-independent sum of row hashes), as strs for the manifest
+    hashes = pd.Series(pd.util.hash_pandas_object(cover, index=False).to_numpy(), index=cover.index)
+    return hashes.groupby(cover.filerIdent.to_numpy()).sum().astype(str).to_dict()
+
+
+
+def changed_hashes(current, previous):
+    # Filers whose cover rows were added, removed or edited since the last run
+    return {id for id in current.keys() | previous.keys() if current.get(id) != previous.get(id)}
+
+
+
+def report_balance(cover):
+    # Sum of positive minus sum of negative amounts, blanks (and cols missing from cover.csv) counting as 0
+    positive, negative = np.zeros(len(cover)), np.zeros(len(cover))
+    for col in positive_cols:
+        if col in cover.columns:
+            positive += cover[col].fillna(0).to_numpy()
+    for col in negative_cols:
+        if col in cover.columns:
+            negative += cover[col].fillna(0).to_numpy()
+    return positive - negative
+
+
+
+def balance_series(cover):
+    """
+    Given cover rows (dates parsed), returns the balance of each filer's reports, latest first, keeping one report per filer and received date
+    (corrections first) and dropping info-only reports.
+    """
+    cover = cover[cover.infoOnlyFlag == 'N']
+    cover = cover.sort_values(['receivedDt', 'timelyCorrectionFlag'], ascending=False, kind='stable')
+    cover = cover.drop_duplicates(['filerIdent', 'receivedDt'], keep='first')
+    cover = cover.assign(balance=report_balance(cover))
+    return cover[series_cols]
+
+
+
+def balance_summary(series):
+    """
+    Given balance series (snake_case cols, each filer's reports latest first), returns one row per filer with its latest balance,
+    the previous report's balance (NaN for filers with a single report), the change between them and the number of reports.
+    """
+    filers = series.groupby('filer_ident', sort=False)
+    rank = filers.cumcount().to_numpy()
+    latest = series[rank == 0].set_index('filer_ident')
+    previous = series[rank == 1].set_index('filer_ident')
+    summary = latest[['filer_name', 'received_dt', 'balance']].assign(
+        previous_received_dt=previous.received_dt.reindex(latest.index),
+        previous_balance=previous.balance.reindex(latest.index))
+    summary['balance_change'] = summary.balance - summary.previous_balance
+    summary['reports'] = filers.size().reindex(latest.index)
+    return summary.reset_index()[summary_cols].sort_values('filer_ident').reset_index(drop=True)
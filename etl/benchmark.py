@@ -0,0 +1,229 @@
+import argparse
+import time
+from io import StringIO
+import numpy as np
+import pandas as pd
+
+from update_data import clean_strs, fill_blank, make_dtypes, contribs_cols
+from normalize import consolidate
+from dates import parse_date_cols
+from balance import positive_cols, negative_cols, cover_hashes, changed_hashes, balance_series, balance_summary
+
+"""
+OBJECTIVE:
+Times ETL hot paths on synthetic, TEC-shaped data so changes can be compared without downloading the TEC zip
+Run from the repo root: python etl/benchmark.py --rows 1000000 10000000
+"""
+
+
+
+def make_text_cols(rows, seed=0):
+    # Few thousand distinct names/cities repeated over many rows, like contributor cols in contribs_*.csv
+    rng = np.random.default_rng(seed)
+    last = np.array([f'smith-{i}' for i in range(5000)] + ["o'neil", 'JONES', ''], dtype=object)
+    first = np.array([f'ann {i}\t' for i in range(2000)] + ['Bob', ''], dtype=object)
+    city = np.array([f'city no. {i}' for i in range(800)] + ['AUSTIN', 'San Antonio\n', ''], dtype=object)
+    org = np.array([f'Acme #{i}, LLC' for i in range(3000)] + [''] * 3000, dtype=object)
+    return pd.DataFrame({
+        'contributorNameLast': last[rng.zipf(1.3, rows) % len(last)],
+        'contributorNameFirst': first[rng.zipf(1.3, rows) % len(first)],
+        'contributorStreetCity': city[rng.zipf(1.3, rows) % len(city)],
+        'contributorNameOrganization': org[rng.integers(0, len(org), rows)],
+    })
+
+
+
+def make_contribs_csv(rows, seed=0):
+    # contribs_*.csv-shaped text with TEC-like code, amount and ident cols
+    rng = np.random.default_rng(seed)
+    data = make_text_cols(rows, seed)
+    data['recordType'] = 'RCPT'
+    data['reportInfoIdent'] = rng.integers(100000000, 110000000, rows).astype(str)
+    data['infoOnlyFlag'] = rng.choice(['N', 'N', 'N', 'Y'], rows)
+    data['filerIdent'] = np.char.zfill(rng.zipf(1.5, rows).clip(max=99999999).astype(str), 8)
+    data['receivedDt'] = data['contributionDt'] = '20220115'
+    data['contributionAmount'] = rng.exponential(300, rows).round(2).astype(str)
+    data['contributionDescr'] = ''
+    data['contributorPersentTypeCd'] = rng.choice(['INDIVIDUAL', 'ENTITY'], rows)
+    data['contributorLawFirmName'] = data['contributorEmployer'] = ''
+    data['contributorStreetPostalCode'] = rng.choice(['78701', '77002', '75201'], rows)
+    data['contributorStreetStateCd'] = rng.choice(['TX', 'CA', 'NY'], rows, p=[.9, .05, .05])
+    data['contributorStreetCountryCd'] = 'USA'
+    return data[contribs_cols].to_csv(index=False)
+
+
+
+def make_entity_cols(rows, seed=0):
+    # Cleaned contributor name and location cols, as passed to consolidate by clean_vardata
+    rng = np.random.default_rng(seed)
+    data = make_text_cols(rows, seed)
+    data['contributorStreetStateCd'] = pd.Categorical(rng.choice(['TX', 'CA', 'NY', ''], rows, p=[.85, .05, .05, .05]))
+    data['contributorStreetPostalCode'] = np.array([f'{78700 + i}' for i in range(2000)] + [''], dtype=object)[rng.zipf(1.3, rows) % 2001]
+    data['contributorStreetCountryCd'] = pd.Categorical(rng.choice(['USA', ''], rows, p=[.95, .05]))
+    for col in data.columns:
+        data[col] = clean_strs(fill_blank(data[col]))
+    return data
+
+
+
+def legacy_consolidate(data):
+    # Name and location consolidation of clean_vardata before normalize.consolidate (locations only for the last prefix)
+    namecolprefixls = [col.split('NameFirst')[0] for col in data.columns if 'NameFirst' in col]
+    for prefix in namecolprefixls:
+        data[prefix + 'Name'] = pd.Series(np.where(
+            (data[prefix + 'NameLast'] != '') & (data[prefix + 'NameFirst'] != '') &
+            (data[prefix + 'NameLast'] + data[prefix + 'NameFirst'] != np.nan),
+            data[prefix + 'NameLast'] + ', ' + data[prefix + 'NameFirst'],
+            np.nan), index=data.index, dtype=object)
+        data[prefix + 'Name'] = data[prefix + 'Name'].str.strip()
+        data.drop(columns=[prefix + 'NameLast', prefix + 'NameFirst'], inplace=True)
+        data[prefix + 'Name'] = np.where(data[prefix + 'NameOrganization'] != '', data[prefix + 'NameOrganization'], data[prefix + 'Name'])
+        data.drop(columns=[prefix + 'NameOrganization'], inplace=True)
+
+    location_cols = [f'{prefix}StreetCity', f'{prefix}StreetStateCd', f'{prefix}StreetPostalCode', f'{prefix}StreetCountryCd']
+    data[location_cols] = \
+        data[location_cols].fillna('').astype(str)
+    data[f'{prefix}Location'] = data[f'{prefix}StreetCity'] + ', ' + data[f'{prefix}StreetStateCd'] + ' ' + \
+        data[f'{prefix}StreetPostalCode'] + ', ' + data[f'{prefix}StreetCountryCd']
+    data.drop(columns=location_cols, inplace=True)
+    return data
+
+
+
+def make_cover(rows, seed=0):
+    # cover.csv rows as parsed by clean_and_export_cover: a few dozen reports per filer, some amended the same day or info-only
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'filerIdent': np.char.zfill(rng.integers(0, rows // 30 + 1, rows).astype(str), 8),
+        'filerName': 'Doe, Jane',
+        'periodStartDt': pd.Timestamp('2022-01-01'),
+        'periodEndDt': pd.Timestamp('2022-06-30'),
+        'receivedDt': pd.Timestamp('2000-01-01') + pd.to_timedelta(rng.integers(0, 9000, rows), unit='D'),
+        'timelyCorrectionFlag': rng.choice(['N', 'Y'], rows, p=[.9, .1]),
+        'infoOnlyFlag': rng.choice(['N', 'Y'], rows, p=[.8, .2]),
+    })
+    for col in positive_cols + negative_cols:
+        data[col] = np.where(rng.random(rows) < .2, np.nan, rng.exponential(1000, rows).round(2))
+    return data
+
+
+
+def legacy_balance(cover):
+    # Balance series of clean_and_export_cover before balance.balance_series, and the app's latest balance lookup per filer
+    cover = cover.sort_values(['receivedDt', 'timelyCorrectionFlag'], ascending=False)
+    cover = cover[cover.infoOnlyFlag == 'N']
+    cover = cover.drop_duplicates(['filerIdent', 'receivedDt'], keep='first')
+    for col in ['periodStartDt', 'periodEndDt']:
+            cover[col] = pd.to_datetime(cover[col], errors='coerce')
+    cover['balance'] = cover[positive_cols].fillna(0).sum(axis=1) - cover[negative_cols].fillna(0).sum(axis=1)
+    cover = cover[['filerIdent', 'filerName', 'receivedDt', 'periodStartDt', 'periodEndDt', 'balance']]
+    return cover.groupby('filerIdent').head(2)
+
+
+
+def incremental_balance(cover, previous):
+    # Hashes every filer's rows, then recomputes only the changed filers' series and the summary
+    changed = changed_hashes(cover_hashes(cover), previous)
+    series = balance_series(cover[cover.filerIdent.isin(changed)])
+    series.columns = ['filer_ident', 'filer_name', 'received_dt', 'period_start_dt', 'period_end_dt', 'balance']
+    return balance_summary(series)
+
+
+
+def make_dates_csv(rows, seed=0):
+    # receivedDt and contributionDt cols of contribs_*.csv: YYYYMMDD strs over 25 years, some blank or in the future
+    rng = np.random.default_rng(seed)
+    received = pd.Timestamp('2000-01-01') + pd.to_timedelta(rng.integers(0, 9000, rows), unit='D')
+    contributed = received - pd.to_timedelta(rng.integers(0, 120, rows), unit='D')
+    contributed = contributed.where(rng.random(rows) > .001, contributed + pd.DateOffset(years=100))
+    data = pd.DataFrame({'receivedDt': received.strftime('%Y%m%d'), 'contributionDt': contributed.strftime('%Y%m%d')})
+    data.loc[rng.random(rows) < .01, 'contributionDt'] = ''
+    return data.to_csv(index=False)
+
+
+
+def legacy_read_dates(text):
+    # read_vardata before parse_date_cols
+    return pd.read_csv(StringIO(text), parse_dates=['receivedDt', 'contributionDt'], date_parser=lambda date: pd.to_datetime(date, errors='coerce'))
+
+
+
+def fast_read_dates(text):
+    return parse_date_cols(pd.read_csv(StringIO(text), dtype=str), ['receivedDt', 'contributionDt'])
+
+
+
+def legacy_clean_strs(col):
+    # Row-by-row cleaning used before clean_strs
+    return col.apply(lambda x: x.title().replace(r'\r+|\n+|\t+','').replace(r'[^A-Za-z0-9 ]+', '').strip())
+
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+
+def bench_clean_strs(rows):
+    data = make_text_cols(rows)
+    legacy = sum(timed(legacy_clean_strs, data[col]) for col in data.columns)
+    vectorized = sum(timed(clean_strs, data[col]) for col in data.columns)
+    print(f'clean_strs ({rows:,} rows x {len(data.columns)} cols): legacy {legacy:.2f}s, vectorized {vectorized:.2f}s, speedup {legacy / vectorized:.1f}x')
+
+
+
+def bench_read_dtypes(rows):
+    text = make_contribs_csv(rows)
+    as_str = pd.read_csv(StringIO(text), dtype=str).memory_usage(deep=True).sum()
+    start = time.perf_counter()
+    typed = pd.read_csv(StringIO(text), dtype=make_dtypes(contribs_cols)).memory_usage(deep=True).sum()
+    seconds = time.perf_counter() - start
+    print(f'read_csv dtypes ({rows:,} contribs rows): str {as_str / 1024**2:,.1f} MB, schema {typed / 1024**2:,.1f} MB ' + \
+        f'({as_str / typed:.1f}x smaller, read in {seconds:.2f}s)')
+
+
+
+def bench_consolidate(rows):
+    data = make_entity_cols(rows)
+    legacy = timed(legacy_consolidate, data.copy())
+    vectorized = timed(consolidate, data, ['contributor'])
+    print(f'consolidate ({rows:,} rows): legacy {legacy:.2f}s, vectorized {vectorized:.2f}s, speedup {legacy / vectorized:.1f}x')
+
+
+
+def bench_parse_dates(rows):
+    text = make_dates_csv(rows)
+    legacy = timed(legacy_read_dates, text)
+    fast = timed(fast_read_dates, text)
+    print(f'read and parse dates ({rows:,} rows x 2 cols): legacy {rows / legacy:,.0f} rows/s, ' + \
+        f'YYYYMMDD with future-date repair {rows / fast:,.0f} rows/s, speedup {legacy / fast:.1f}x')
+
+
+
+def bench_balance(rows):
+    # Nightly case: 1% of filers filed or amended a report since the last run
+    cover = make_cover(rows)
+    filers = cover.filerIdent.unique()
+    edited = cover.filerIdent.isin(filers[:max(len(filers) // 100, 1)])
+    previous = cover_hashes(cover.assign(totalContribAmount=cover.totalContribAmount.where(~edited, 0)))
+    legacy = timed(legacy_balance, cover)
+    incremental = timed(incremental_balance, cover, previous)
+    print(f'balance ({rows:,} cover rows, 1% of filers changed): legacy {legacy:.2f}s, incremental {incremental:.2f}s, speedup {legacy / incremental:.1f}x')
+
+
+
+def main(args):
+    for rows in args.rows:
+        bench_clean_strs(rows)
+        bench_read_dtypes(rows)
+        bench_consolidate(rows)
+        bench_parse_dates(rows)
+        bench_balance(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks ETL hot paths on synthetic data')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    main(parser.parse_args())
@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+
+import update_data
+from synthetic import make_tec_zip
+
+# The app's data access and table modules are timed on the ETL's output
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+import data_access
+from tables import prepare_table, group_data
+from compare import shared_counterparties
+
+"""
+OBJECTIVE:
+End-to-end benchmark of the ETL and the app's data paths on a synthetic TEC zip, so regressions show up before the nightly job times out
+Writes the zip with synthetic.py (reused by later runs of the same scale), runs update_data on it in a scratch dir, then times the app's
+loaders (fetching a filer's transactions and aggregates over HTTP from a local server, or querying the store) and table functions
+on the largest filers of the output. Each run appends the ETL's stages and the app timings as one JSON line to a results file
+and is compared with the last run of the same scale and options, flagging timings slower than --tolerance times the previous one
+Run from the repo root: python etl/benchmark_suite.py --filers 2000 --rows 1000000 --parquet
+"""
+
+# (var, prefix, var_short) of the app's dtypes timed, and timings too short to compare reliably
+dtypes = [['Contribution', 'Contributor', 'contribs'], ['Expenditure', 'Payee', 'expend']]
+min_seconds = 0.05
+
+
+
+def run_etl(zippath, workdir, args):
+    # Runs update_data on zippath in a fresh workdir and returns the run's stats record
+    shutil.rmtree(workdir, ignore_errors=True)
+    for var in ['contribs', 'expend', 'loans', 'balance']:
+        os.makedirs(f'{workdir}/data/processed/{var}')
+    os.makedirs(f'{workdir}/data/documentation')
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        argv = ['--zip', zippath, '--workers', str(args.workers), '--chunksize', str(args.chunksize), '--years', str(args.years)]
+        argv += ['--parquet'] * args.parquet + ['--store', 'data/processed/tec.sqlite'] * args.store
+        update_data.main(update_data.parse_args(argv))
+        with open('data/documentation/etl_stats.jsonl') as f:
+            return json.loads(f.readlines()[-1])
+    finally:
+        os.chdir(cwd)
+
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    # Serves the directory passed to serve() without logging every request to stderr
+    directory = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=self.directory, **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+
+
+def serve(directory):
+    # Serves directory on a local port in a daemon thread, standing in for the S3 bucket the app reads from
+    handler = type('Handler', (QuietHandler,), {'directory': directory})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+
+def largest_filers(workdir, var, n):
+    # Idents of the n filers with the largest transaction files
+    files = [file for file in os.listdir(f'{workdir}/data/processed/{var}') if file.endswith('_view.csv')]
+    files.sort(key=lambda file: os.path.getsize(f'{workdir}/data/processed/{var}/{file}'), reverse=True)
+    return [file[len(var) + 1:-len('_view.csv')] for file in files[:n]]
+
+
+
+def app_cols(data):
+    # Col names as the app's loaders rename them
+    data.columns = data.columns.str.replace('_', ' ').str.title().str.replace('Expend', 'Expenditure')
+    return data
+
+
+
+def load_transactions(ids, dtype):
+    # filter_data's loading path: the store if set, else the _view files
+    var = dtype[0]
+    datecols = [('expend' if var == 'Expenditure' else var.lower()) + '_dt', 'received_dt']
+    if data_access.store_path:
+        data = data_access.query(dtype[2], ids, datecols)
+    else:
+        data = pd.concat(data_access.fetch_many([(f'{dtype[2]}/{dtype[2]}_{id}_view', True, {'low_memory': False, 'parse_dates': datecols}) for id in ids]))
+    data = app_cols(data.copy())
+    return data.assign(year=data[f'{var} Dt'].dt.year)
+
+
+
+def load_counterparties(ids, dtype):
+    # filter_aggregates' loading path for the counterparty aggregates
+    if data_access.store_path:
+        data = data_access.query(f'{dtype[2]}_counterparties', ids)
+    else:
+        data = pd.concat(data_access.fetch_many([(f'{dtype[2]}/{dtype[2]}_{id}_counterparties', False, {'dtype': {'filer_ident': str}}) for id in ids]))
+    data = app_cols(data.copy()).rename(columns={'Year': 'year'})
+    return data[[col for col in data.columns if col != 'Filer Ident']]
+
+
+
+def timed(func, *args, repeat=3, cold=False):
+    # Best of repeat runs; cold runs empty the app's cache first so every run fetches or queries again
+    best = None
+    for _ in range(repeat):
+        if cold:
+            data_access.cache.drop_stale(object())
+        start = time.perf_counter()
+        func(*args)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+
+def bench_app(workdir, args):
+    """
+    Returns {function: seconds} for the app's loaders and table functions on the largest filers of each dtype,
+    reading the ETL's output in workdir like the deployed app (Parquet first if --parquet, the store if --store).
+    """
+    server = serve(workdir)
+    data_access.data_url = f'http://127.0.0.1:{server.server_address[1]}/data'
+    data_access.data_format = 'parquet' if args.parquet else 'csv'
+    data_access.store_path = f'{workdir}/data/processed/tec.sqlite' if args.store else None
+    data_access.state['version'] = 'benchmark'
+
+    timings = {}
+    try:
+        for dtype in dtypes:
+            var, prefix, var_short = dtype
+            ids = largest_filers(workdir, var_short, args.app_filers)
+            if not ids:
+                continue
+            timings[f'{var_short}/filter_data'] = timed(load_transactions, ids[:1], dtype, cold=True)
+            timings[f'{var_short}/filter_aggregates'] = timed(load_counterparties, ids[:1], dtype, cold=True)
+            data, counterparties = load_transactions(ids[:1], dtype), load_counterparties(ids[:1], dtype)
+            timings[f'{var_short}/prepare_table'] = timed(lambda: prepare_table(data.copy(), var, prefix))
+            timings[f'{var_short}/group_data'] = timed(group_data, var, prefix, counterparties)
+            by_filer = [load_counterparties([id], dtype) for id in ids]
+            timings[f'{var_short}/shared_counterparties ({len(ids)} filers)'] = timed(shared_counterparties, by_filer, dtype)
+            print(f'\t{var_short}: largest filer {ids[0]} ({len(data):,} rows, {len(counterparties):,} counterparty rows)')
+    finally:
+        server.shutdown()
+    return timings
+
+
+
+def previous_run(path, scale, options):
+    # Last record of path with the same scale and options, None if there is none
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    matches = [record for record in records if record['scale'] == scale and record['options'] == options]
+    return matches[-1] if matches else None
+
+
+
+def compare_runs(previous, record, tolerance):
+    # Prints each timing next to the previous run's and flags the ones slower than tolerance times it
+    timings = [(f'etl/{name}', stage['wall_s'], previous['etl']['stages'].get(name, {}).get('wall_s') if previous else None)
+        for name, stage in record['etl']['stages'].items()]
+    timings.append(('etl (total)', record['etl']['wall_s'], previous['etl']['wall_s'] if previous else None))
+    timings += [(f'app/{name}', seconds, previous['app'].get(name) if previous else None) for name, seconds in record['app'].items()]
+
+    regressions = 0
+    print(f'{"Timing":<56}{"seconds":>10}{"previous":>10}')
+    for name, seconds, before in timings:
+        flag = ''
+        if before is not None and max(seconds, before) >= min_seconds and seconds > before * tolerance:
+            regressions += 1
+            flag = '  REGRESSION'
+        print(f'{name:<56}{seconds:>10.3f}' + (f'{before:>10.3f}' if before is not None else ' ' * 10) + flag)
+    return regressions
+
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def main(args):
+    scale = {'filers': args.filers, 'rows': args.rows, 'member_rows': args.member_rows, 'seed': args.seed}
+    options = {'workers': args.workers, 'chunksize': args.chunksize, 'years': args.years, 'parquet': args.parquet, 'store': args.store}
+    workdir = os.path.abspath(args.workdir)
+
+    zippath = f'{workdir}/TEC_{args.filers}_{args.rows}_{args.member_rows}_{args.seed}.zip'
+    if not os.path.exists(zippath):
+        make_tec_zip(zippath, args.filers, args.rows, args.member_rows, args.seed)
+
+    stats = run_etl(zippath, f'{workdir}/run', args)
+    print('Timing the app')
+    record = {'finished': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': git_commit(), 'scale': scale, 'options': options,
+        'etl': {key: stats[key] for key in ['wall_s', 'cpu_s', 'peak_rss_mb', 'stages']}, 'app': bench_app(f'{workdir}/run', args)}
+
+    previous = previous_run(args.results, scale, options)
+    regressions = compare_runs(previous, record, args.tolerance)
+    if previous is not None:
+        print(f'{regressions} regressions against the run of {previous["finished"]} ({previous["commit"]})')
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the ETL and the app on a synthetic TEC zip')
+    parser.add_argument('--filers', type=int, default=2000, help='Filer idents of the synthetic zip (default: 2000)')
+    parser.add_argument('--rows', type=int, default=1000000, help='Contributions of the synthetic zip (default: 1000000)')
+    parser.add_argument('--member-rows', type=int, default=500000, help='Max rows of each contribs/expend member (default: 500000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help='ETL worker processes (default: 1)')
+    parser.add_argument('--chunksize', type=int, default=250000, help='ETL chunk size (default: 250000)')
+    parser.add_argument('--years', type=int, default=0, help='ETL year window, 0 for all years (default: 0)')
+    parser.add_argument('--parquet', action='store_true', help='Run the ETL with --parquet and read Parquet files in the app')
+    parser.add_argument('--store', action='store_true', help='Run the ETL with --store and query the store in the app')
+    parser.add_argument('--app-filers', type=int, default=3, help='Largest filers the app functions are timed on (default: 3)')
+    parser.add_argument('--workdir', default=f'{os.getcwd()}/.cache/benchmark', help='Directory of the synthetic zip and the ETL output (default: .cache/benchmark)')
+    parser.add_argument('--results', default=f'{os.getcwd()}/.cache/benchmark/results.jsonl',
+        help='File each run is appended to as one JSON line and compared with (default: .cache/benchmark/results.jsonl)')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='Slowdown ratio reported as a regression (default: 1.25)')
+    main(parser.parse_args())
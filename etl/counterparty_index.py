@@ -0,0 +1,85 @@
+import os
+import pandas as pd
+
+from normalize import entity_keys
+
+"""
+OBJECTIVE:
+Cross-filer counterparty index: for each contributor, payee or lender (normalized name and location), the filers it appears in
+with their totals. Stored as one Parquet file per var sorted by key, in row groups small enough that a lookup only reads
+the row groups whose key statistics cover it, so "which filers did this contributor give to" is a single index read
+"""
+
+# Rows per Parquet row group; smaller groups make lookups read less, larger ones compress better
+row_group_rows = 50000
+index_cols = ['key', 'filer_ident', 'filer_name', 'counterparty_name', 'counterparty_location', 'amount', 'count', 'first_year', 'last_year']
+
+
+
+def make_counterparty_index(counterparties, prefix):
+    """
+    Given the yearly per-filer counterparty aggregates of a var (filer_ident, filer_name, year, {prefix}_* cols, amount, count, ...),
+    returns one row per counterparty key and filer with the filer's total amount and count and the first and last years, sorted by key.
+    """
+    if counterparties is None or len(counterparties) == 0:
+        return pd.DataFrame(columns=index_cols)
+
+    data = counterparties[['filer_ident', 'filer_name', 'year', 'amount', 'count']].assign(
+        key=entity_keys(counterparties[f'{prefix}_name'], counterparties[f'{prefix}_location']),
+        counterparty_name=counterparties[f'{prefix}_name'], counterparty_location=counterparties[f'{prefix}_location'])
+    index = data.groupby(['key', 'filer_ident'], sort=True).agg(
+        filer_name=('filer_name', 'first'), counterparty_name=('counterparty_name', 'first'), counterparty_location=('counterparty_location', 'first'),
+        amount=('amount', 'sum'), count=('count', 'sum'), first_year=('year', 'min'), last_year=('year', 'max')).reset_index()
+
+    return index[index_cols]
+
+
+
+def index_table(index):
+    # Arrow table of a make_counterparty_index df with the index file's types, far smaller in memory than the df's object cols
+    import pyarrow as pa
+
+    index = index.astype({'key': str, 'filer_ident': str, 'amount': float, 'count': 'int64', 'first_year': 'Int64', 'last_year': 'Int64'})
+    schema = pa.schema([(col, pa.float64() if col == 'amount' else pa.int64() if col in ['count', 'first_year', 'last_year'] else pa.string())
+        for col in index_cols])
+    return pa.Table.from_pandas(index[index_cols].reset_index(drop=True), schema=schema, preserve_index=False)
+
+
+
+def export_counterparty_index(tables, path, previous=None, changed=None):
+    """
+    Writes the index_table tables of a var (e.g. one per batch of filers) to path as one Parquet file sorted by key.
+    If changed is set (incremental run), tables only hold the rebuilt filers, so they are merged with the entries of the other filers
+    from the previous index file.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    tables = [index_table(pd.DataFrame(columns=index_cols)), *tables]
+    if changed is not None and previous is not None and os.path.exists(previous):
+        kept = pq.read_table(previous)
+        kept = kept.filter(pc.invert(pc.is_in(kept['filer_ident'], value_set=pa.array(sorted(changed), pa.string()))))
+        tables.insert(1, kept.cast(tables[0].schema))
+
+    # Taking the sorted rows one row group at a time rather than copying the whole index in order
+    index = pa.concat_tables(tables)
+    order = pc.sort_indices(index, sort_keys=[('key', 'ascending'), ('filer_ident', 'ascending')])
+    with pq.ParquetWriter(path, index.schema, compression='snappy', use_dictionary=['filer_ident', 'filer_name']) as writer:
+        for start in range(0, max(len(index), 1), row_group_rows):
+            writer.write_table(index.take(order[start:start + row_group_rows]), row_group_size=row_group_rows)
+
+
+
+def lookup(path, name, location=None):
+    """
+    Returns the index rows of the counterparties named name (and located in location, if passed), normalized like the index keys.
+    Without a location, every location of the name matches.
+    """
+    key = entity_keys(pd.Series([name]), pd.Series([location or '']))[0]
+    if location is None:
+        key = key.split('|')[0] + '|'
+        filters = [('key', '>=', key), ('key', '<', key[:-1] + chr(ord('|') + 1))]
+    else:
+        filters = [('key', '==', key)]
+    return pd.read_parquet(path, filters=filters)
@@ -0,0 +1,54 @@
+from datetime import date
+import numpy as np
+import pandas as pd
+
+"""
+OBJECTIVE:
+Date parsing of the TEC files, which write dates as YYYYMMDD strs
+Each distinct str is parsed once with the known format (a chunk holds a few thousand distinct dates over up to millions of rows)
+and mapped back to the rows; the few strs not in that format fall back to pandas' inference, as read_csv parsed them before.
+Transaction dates in the future (typos in the year) are moved to the year of the report's received date
+"""
+
+
+
+def parse_dates(values):
+    # datetime64 Series of YYYYMMDD strs, NaT for blanks and unparseable strs
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    parsed = pd.to_datetime(uniques, format='%Y%m%d', errors='coerce')
+    other = parsed.isna()
+    if other.any():
+        parsed = parsed.where(~other, pd.to_datetime(uniques.where(other, ''), errors='coerce'))
+    # Blanks have code -1, which takes the NaT appended after the uniques (the only value when every row is blank)
+    dates = np.append(parsed.to_numpy(), np.datetime64('NaT', 'ns')).take(codes)
+    return pd.Series(dates, index=values.index, name=values.name)
+
+
+
+def repair_future_dates(dates, comp_dates, today=None):
+    """
+    Returns dates with the ones after today (date.today() if not passed) moved to the year of comp_dates, keeping month and day.
+    Dates whose comp_date is missing are kept; moved dates that do not exist in that year (Feb 29) become NaT.
+    """
+    future = ((dates > pd.Timestamp(today or date.today())) & comp_dates.notna()).to_numpy()
+    if not future.any():
+        return dates
+    moved = pd.to_datetime(pd.DataFrame({'year': comp_dates[future].dt.year, 'month': dates[future].dt.month,
+        'day': dates[future].dt.day}), errors='coerce')
+    dates = dates.copy()
+    dates[future] = moved.to_numpy()
+    return dates
+
+
+
+def parse_date_cols(data, datecols):
+    """
+    Parses datecols of a raw TEC df in place. If there are several, the last one (the transaction date) is repaired
+    against the first one (the received date) with repair_future_dates.
+    """
+    for col in datecols:
+        data[col] = parse_dates(data[col])
+    if len(datecols) > 1:
+        data[datecols[-1]] = repair_future_dates(data[datecols[-1]], data[datecols[0]])
+    return data
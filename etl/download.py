@@ -0,0 +1,116 @@
+import json
+import mmap
+import os
+import requests
+from zipfile import ZipFile
+
+"""
+OBJECTIVE:
+Downloads the TEC zip to a local cache file
+Streams it to disk instead of memory, skips the download if the server reports it unchanged (ETag / Last-Modified)
+and resumes interrupted downloads with HTTP range requests
+"""
+
+
+
+def load_meta(path):
+    try:
+        with open(f'{path}.json') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+
+def save_meta(path, meta):
+    with open(f'{path}.json', 'w') as f:
+        json.dump(meta, f)
+
+
+
+def validators(response):
+    return {key: response.headers[header] for key, header in [('etag', 'ETag'), ('last_modified', 'Last-Modified')] if header in response.headers}
+
+
+
+def download_zip(url, path, retries=3, chunk_size=1024**2, timeout=60):
+    """
+    Makes sure path holds an up-to-date copy of the file at url and returns True if it was (re)downloaded, False if the cached copy was current.
+    Progress goes to {path}.part, which later attempts or runs resume from if the server still has the same file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = f'{path}.part'
+    meta = load_meta(path)
+
+    for attempt in range(retries + 1):
+        headers = {'Accept-Encoding': 'identity'}
+        validator = meta.get('partial', {}).get('etag') or meta.get('partial', {}).get('last_modified')
+        if os.path.exists(part) and not validator:
+            # Without a validator the server cannot tell us whether the partial file is still current, so starting over
+            os.remove(part)
+            meta.pop('partial', None)
+        if os.path.exists(part):
+            # Resuming only if the file on the server is still the one we started downloading
+            headers['Range'] = f'bytes={os.path.getsize(part)}-'
+            headers['If-Range'] = validator
+        elif os.path.exists(path) and meta.get('complete'):
+            if 'etag' in meta['complete']:
+                headers['If-None-Match'] = meta['complete']['etag']
+            if 'last_modified' in meta['complete']:
+                headers['If-Modified-Since'] = meta['complete']['last_modified']
+
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304:
+                    print('\tTEC zip not modified since last download', " "*80)
+                    return False
+                if response.status_code == 416:
+                    # Partial file is already as long as the file on the server, so starting over
+                    os.remove(part)
+                    meta.pop('partial', None)
+                    continue
+                response.raise_for_status()
+
+                if response.status_code == 206:
+                    mode = 'ab'
+                    done = os.path.getsize(part)
+                    print(f'\tResuming download at {done / 1024**2:,.1f} MB', " "*80)
+                else:
+                    mode = 'wb'
+                    done = 0
+                    meta['partial'] = validators(response)
+                    save_meta(path, meta)
+                total = done + int(response.headers.get('Content-Length', 0))
+
+                with open(part, mode) as f:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                        done += len(chunk)
+                        print(f'\tDownloaded {done / 1024**2:,.1f} MB', " "*80, end='\r')
+
+            if total > done:
+                raise requests.exceptions.ChunkedEncodingError(f'Download ended at {done:,} of {total:,} bytes')
+            os.replace(part, path)
+            meta['complete'] = meta.pop('partial')
+            save_meta(path, meta)
+            print(f'\tDownloaded {done / 1024**2:,.1f} MB', " "*80)
+            return True
+
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout) as e:
+            if attempt == retries:
+                raise
+            print(f'\tDownload interrupted ({e}), retrying', " "*80)
+
+
+
+class MappedFile(mmap.mmap):
+    # ZipFile checks seekable(), which mmap objects only have from Python 3.13
+    def seekable(self):
+        return True
+
+
+
+def open_zip(path):
+    # Memory-mapping the archive lets the OS page members in on demand and share pages between processes
+    with open(path, 'rb') as f:
+        return ZipFile(MappedFile(f.fileno(), 0, access=mmap.ACCESS_READ))
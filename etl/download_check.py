@@ -0,0 +1,141 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from download import download_zip, load_meta, save_meta
+
+"""
+OBJECTIVE:
+Checks download_zip's conditional and resumed downloads against a local server that honors Range, If-Range, If-None-Match
+and If-Modified-Since like S3 does, so changes to download.py can be tried without the TEC's server
+Covers a fresh download (200), an unchanged file (304), a resumed download (206), a resume after the file changed (If-Range
+mismatch, 200), a partial file as long as the file (416) and a partial file without validators (not resumed)
+Run from the repo root: python etl/download_check.py
+"""
+
+etag = '"v1"'
+last_modified = 'Mon, 02 Oct 2023 10:00:00 GMT'
+
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # Serves body with its validators; requests are recorded as (status, headers) so checks can see what was sent
+    body = b''
+    etag = etag
+    last_modified = last_modified
+    requests = []
+
+    def do_GET(self):
+        current = self.headers.get('If-Range') in (None, self.etag, self.last_modified)
+        start = None
+        if self.headers.get('Range') and current:
+            start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+
+        if self.headers.get('If-None-Match') == self.etag or (self.headers.get('If-None-Match') is None
+                and self.headers.get('If-Modified-Since') == self.last_modified):
+            self.reply(304)
+        elif start is not None and start >= len(self.body):
+            self.reply(416, headers={'Content-Range': f'bytes */{len(self.body)}'})
+        elif start is not None:
+            self.reply(206, self.body[start:], {'Content-Range': f'bytes {start}-{len(self.body) - 1}/{len(self.body)}'})
+        else:
+            self.reply(200, self.body)
+
+    def reply(self, status, body=b'', headers={}):
+        type(self).requests.append((status, dict(self.headers)))
+        self.send_response(status)
+        for header, value in [('ETag', self.etag), ('Last-Modified', self.last_modified)] + list(headers.items()):
+            if value:
+                self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+
+def serve(body, etag=etag, last_modified=last_modified):
+    # Serves body with these validators on a local port in a daemon thread
+    handler = type('Handler', (RangeHandler,), {'body': body, 'etag': etag, 'last_modified': last_modified, 'requests': []})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, handler
+
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+
+def interrupt(path, body, done, partial):
+    # Leaves path as a download interrupted after done bytes, with partial as the validators recorded when it started
+    with open(f'{path}.part', 'wb') as f:
+        f.write(body[:done])
+    save_meta(path, {'partial': partial})
+    if os.path.exists(path):
+        os.remove(path)
+
+
+
+def check(name, condition):
+    print(f'\t{"ok" if condition else "FAILED":<8}{name}')
+    return condition
+
+
+
+def main(args):
+    body = os.urandom(args.size)
+    workdir = tempfile.mkdtemp()
+    path = f'{workdir}/cache/TEC_CF_CSV.zip'
+    results = []
+    try:
+        server, handler = serve(body)
+        url = f'http://127.0.0.1:{server.server_address[1]}/TEC_CF_CSV.zip'
+        results.append(check('fresh download (200)', download_zip(url, path) and read(path) == body
+            and handler.requests[-1][0] == 200 and load_meta(path)['complete'] == {'etag': etag, 'last_modified': last_modified}))
+        results.append(check('unchanged file (304)', not download_zip(url, path) and handler.requests[-1][0] == 304
+            and handler.requests[-1][1].get('If-None-Match') == etag))
+
+        interrupt(path, body, len(body) // 3, {'etag': etag})
+        results.append(check('resumed download (206)', download_zip(url, path) and read(path) == body
+            and handler.requests[-1][0] == 206 and handler.requests[-1][1].get('If-Range') == etag))
+
+        interrupt(path, body, len(body) // 3, {'last_modified': last_modified})
+        results.append(check('resumed on Last-Modified (206)', download_zip(url, path) and read(path) == body
+            and handler.requests[-1][0] == 206 and handler.requests[-1][1].get('If-Range') == last_modified))
+
+        interrupt(path, body, len(body), {'etag': etag})
+        results.append(check('partial file complete (416, then 200)', download_zip(url, path) and read(path) == body
+            and [status for status, _ in handler.requests[-2:]] == [416, 200]))
+
+        interrupt(path, b'x' * len(body), len(body) // 2, {})
+        results.append(check('partial file without validators restarted (200)', download_zip(url, path) and read(path) == body
+            and handler.requests[-1][0] == 200 and 'Range' not in handler.requests[-1][1]))
+        server.shutdown()
+
+        changed = os.urandom(args.size)
+        server, handler = serve(changed, '"v2"', 'Tue, 03 Oct 2023 10:00:00 GMT')
+        url = f'http://127.0.0.1:{server.server_address[1]}/TEC_CF_CSV.zip'
+        interrupt(path, body, len(body) // 3, {'etag': etag})
+        results.append(check('resume after the file changed (If-Range mismatch, 200)', download_zip(url, path) and read(path) == changed
+            and handler.requests[-1][0] == 200 and load_meta(path)['complete']['etag'] == '"v2"'))
+        results.append(check('changed file current afterwards (304)', not download_zip(url, path) and handler.requests[-1][0] == 304))
+        server.shutdown()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f'{sum(results)} of {len(results)} checks passed')
+    return all(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Checks download_zip's conditional and resumed downloads against a local server")
+    parser.add_argument('--size', type=int, default=3 * 1024**2 + 17, help='Bytes of the file served (default: 3 MB)')
+    raise SystemExit(0 if main(parser.parse_args()) else 1)
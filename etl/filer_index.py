@@ -0,0 +1,56 @@
+import json
+import re
+
+"""
+OBJECTIVE:
+Builds the filer search index the app loads next to filers.csv (filers_index.json)
+Maps each filer name to its idents and filers.csv rows, each filer type to its names and each name token to
+the names containing it, so the app's filer widgets and lookups don't scan the whole filers table.
+Also holds the filer name each ident's per-filer files are exported with (partitions)
+"""
+
+
+
+def search_tokens(name):
+    # Lowercase alphanumeric words of a name; the app normalizes queries the same way
+    return re.findall(r'[a-z0-9]+', name.lower())
+
+
+
+def make_filer_index(filers, partitions=None):
+    """
+    Given the filers df as written to filers.csv and optionally a dict of ident -> lowercased exported filer name, returns a dict with:
+    names: filer names in order of first appearance in filers.csv
+    idents, rows: for each name, its filer idents and its row positions in filers.csv
+    types: for each filer type (filerPersentTypeCd), positions in names of the filers of that type
+    tokens: sorted [token, name position] pairs for prefix search
+    partitions: ident -> lowercased exported filer name (if passed)
+    """
+    positions = {}
+    names, idents, rows = [], [], []
+    types = {}
+    for row, (ident, filer_type, name) in enumerate(zip(filers.filerIdent, filers.filerPersentTypeCd, filers.filerName)):
+        if name == '':
+            continue
+        if name not in positions:
+            positions[name] = len(names)
+            names.append(name)
+            idents.append([])
+            rows.append([])
+        i = positions[name]
+        if ident not in idents[i]:
+            idents[i].append(ident)
+        rows[i].append(row)
+        types.setdefault(str(filer_type), set()).add(i)
+
+    tokens = sorted({(token, i) for i, name in enumerate(names) for token in search_tokens(name)})
+    index = {'names': names, 'idents': idents, 'rows': rows, 'types': {key: sorted(value) for key, value in types.items()}, 'tokens': tokens}
+    if partitions is not None:
+        index['partitions'] = partitions
+    return index
+
+
+
+def export_filer_index(filers, partitions, outdir):
+    with open(f'{outdir}/filers_index.json', 'w') as f:
+        json.dump(make_filer_index(filers, partitions), f, separators=(',', ':'))
@@ -0,0 +1,138 @@
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+"""
+OBJECTIVE:
+Stage-level instrumentation of the ETL
+Accumulates wall time, CPU time, calls, rows in and out and peak memory per named stage (e.g. contribs/merge),
+merges the stages timed in pool workers and appends one JSON record per run, so stage trends can be tracked across nightly runs
+"""
+
+# Peak memory records of the stages currently running, outermost first
+open_stages = []
+# Highest VmHWM read before a stage reset it, since resets also clear ru_maxrss on Linux
+saved_peak = {'mb': 0}
+
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024**2
+    return peak / 1024
+
+
+
+def hwm_mb():
+    # High-water mark of the process' RSS since it started or was last reset (VmHWM), None where /proc is not available
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+
+def process_peak_mb():
+    # Peak RSS of the process since it started, across the resets of stages on Linux
+    hwm = hwm_mb()
+    if hwm is None:
+        return peak_rss_mb()
+    return max(saved_peak['mb'], hwm)
+
+
+
+def reset_hwm():
+    # Resets VmHWM to the current RSS (Linux); False where clear_refs is missing or not writable
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+
+class Stages:
+    """
+    Per-stage totals of a run or of a chunk cleaned in a pool worker. Wall and CPU times are summed over a stage's calls
+    (so stages run by several workers can add up to more than the run's wall time), and peak_rss_mb is the highest RSS
+    of the process that ran the stage while it ran, over its calls. On Linux, the RSS high-water mark is reset at the start
+    of each stage (stages still running keep the peak reached before the reset). Elsewhere it cannot be reset, so a call
+    only records the process' peak if it raised it, and peak_rss_mb is None for stages that never did.
+    process_peak is the peak RSS of the process that ran the stages (as of the last one that ended) and worker_peak
+    the highest process_peak of the stages merged from other processes, e.g. chunks cleaned in pool workers.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.pid = os.getpid()
+        self.process_peak = None
+        self.worker_peak = None
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        # Times the with block; rows_out can be set on the yielded dict inside it and defaults to rows_in for stages keeping every row
+        record = {'rows_in': rows_in, 'rows_out': rows_in}
+        peak = {'mb': None}
+        hwm = hwm_mb()
+        for outer in open_stages if hwm is not None else []:
+            outer['mb'] = max(outer['mb'] or 0, hwm)
+        if hwm is not None:
+            saved_peak['mb'] = max(saved_peak['mb'], hwm)
+        reset = reset_hwm()
+        before = peak_rss_mb()
+        open_stages.append(peak)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            open_stages.remove(peak)
+            if reset:
+                peak['mb'] = max(peak['mb'] or 0, hwm_mb())
+            elif peak_rss_mb() > before:
+                peak['mb'] = peak_rss_mb()
+            self.process_peak = process_peak_mb()
+            self.add(name, {'calls': 1, 'wall_s': time.perf_counter() - wall, 'cpu_s': time.process_time() - cpu,
+                'rows_in': record['rows_in'], 'rows_out': record['rows_out'], 'peak_rss_mb': peak['mb']})
+
+    def add(self, name, totals):
+        stage = self.stages.setdefault(name, {'calls': 0, 'wall_s': 0, 'cpu_s': 0, 'rows_in': None, 'rows_out': None, 'peak_rss_mb': None})
+        for key in ['calls', 'wall_s', 'cpu_s']:
+            stage[key] += totals[key]
+        for key in ['rows_in', 'rows_out']:
+            if totals[key] is not None:
+                stage[key] = (stage[key] or 0) + int(totals[key])
+        if totals['peak_rss_mb'] is not None:
+            stage['peak_rss_mb'] = max(stage['peak_rss_mb'] or 0, totals['peak_rss_mb'])
+
+    def merge(self, other, prefix=''):
+        for name, totals in other.stages.items():
+            self.add(prefix + name, totals)
+        if other.pid != self.pid:
+            peaks = [peak for peak in [self.worker_peak, other.process_peak, other.worker_peak] if peak is not None]
+            self.worker_peak = max(peaks) if peaks else None
+
+    def report(self):
+        print(f'{"Stage":<36}{"calls":>8}{"wall s":>10}{"cpu s":>10}{"rows in":>14}{"rows out":>14}{"peak MB":>10}')
+        for name, stage in self.stages.items():
+            rows_in, rows_out = [f'{stage[key]:,}' if stage[key] is not None else '' for key in ['rows_in', 'rows_out']]
+            peak = f'{stage["peak_rss_mb"]:,.1f}' if stage['peak_rss_mb'] is not None else ''
+            print(f'{name:<36}{stage["calls"]:>8,}{stage["wall_s"]:>10.2f}{stage["cpu_s"]:>10.2f}{rows_in:>14}{rows_out:>14}{peak:>10}')
+
+    def save(self, path, **run):
+        # Appends the run's stages as one JSON line, with run info (args, totals) passed as keywords
+        record = {'finished': datetime.now(timezone.utc).isoformat(timespec='seconds'), **run,
+            'stages': {name: {key: round(value, 3) if isinstance(value, float) else value for key, value in stage.items()} for name, stage in self.stages.items()}}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+
+"""
+OBJECTIVE:
+Bookkeeping for incremental ETL runs
+Tracks zip member checksums, filer record hashes and processed file hashes between runs so that only
+filers whose source rows changed are rebuilt, and only files whose content changed are rewritten
+"""
+
+
+
+def manifest_path():
+    return f'{os.getcwd()}/data/processed/manifest.json'
+
+
+
+def load_manifest():
+    try:
+        with open(manifest_path()) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+    for key in ['vars', 'members', 'member_filers', 'filers', 'files']:
+        manifest.setdefault(key, {})
+    return manifest
+
+
+
+def save_manifest(manifest):
+    with open(manifest_path(), 'w') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+
+
+
+def member_checksum(zf, member):
+    info = zf.getinfo(member)
+    return f'{info.CRC:08x}-{info.file_size}'
+
+
+
+def filer_hashes(filers):
+    # One hash per filer record, so changes to a filer's name, office etc. mark its files as stale
+    hashes = pd.util.hash_pandas_object(filers.set_index('filerIdent').astype(str), index=False)
+    return dict(zip(filers.filerIdent, hashes.astype(str)))
+
+
+
+def stale_filers(filers, manifest):
+    # Filers added, removed or edited in filers.csv since the last run
+    current = filer_hashes(filers)
+    previous = manifest['filers']
+    return {id for id in current.keys() | previous.keys() if current.get(id) != previous.get(id)}
+
+
+
+def changed_filers(zf, var, members, manifest, stale):
+    """
+    Returns the set of filer idents whose rows for var may have changed since the last run, or None if every filer must be rebuilt
+    (no previous run, or a previously processed member is gone or changed and the filers it held are unknown).
+    Filers of a changed member are those of its new version and those the last run recorded for it, so filers whose rows were removed
+    or moved to another member are rebuilt too.
+    """
+    prev_members = manifest['vars'].get(var)
+    if prev_members is None or any(member not in members for member in prev_members):
+        return None
+
+    changed = set(stale)
+    for member in members:
+        if manifest['members'].get(member) != member_checksum(zf, member):
+            if member in prev_members and member not in manifest['member_filers']:
+                return None
+            print('\tChanged', member.split('/')[-1], " "*80, end='\r')
+            changed.update(pd.read_csv(zf.open(member), usecols=['filerIdent'], dtype=str).filerIdent.dropna())
+            changed.update(manifest['member_filers'].get(member, []))
+    return changed
+
+
+
+def record_members(zf, var, members, manifest, member_filers=None):
+    # member_filers, if passed, is {member: filer idents with rows in it}, recorded for changed_filers
+    manifest['vars'][var] = members
+    for member in members:
+        manifest['members'][member] = member_checksum(zf, member)
+        if member_filers is not None:
+            manifest['member_filers'][member] = sorted(member_filers.get(member, []))
+
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+
+def remove_stale_files(staging, outdir, prefix, changed, manifest):
+    """
+    Deletes the per-filer files of outdir ({prefix}_{id}.csv, {prefix}_{id}_view.csv etc.) of filers in changed (every filer if None)
+    that staging has no new version of, i.e. files of filers left without rows, and forgets their hashes.
+    Must run before publish_files moves staging's files. Returns the number of files deleted.
+    """
+    staged = set(os.listdir(staging))
+    removed = 0
+    for file in sorted(os.listdir(outdir)):
+        id = file[len(prefix) + 1:].split('_')[0].split('.')[0]
+        if file.startswith(f'{prefix}_') and file not in staged and (changed is None or id in changed):
+            os.remove(f'{outdir}/{file}')
+            manifest['files'].pop(os.path.relpath(f'{outdir}/{file}', f'{os.getcwd()}/data/processed'), None)
+            removed += 1
+    return removed
+
+
+
+def publish_files(staging, outdir, manifest):
+    """
+    Moves files from staging into outdir, skipping those whose content is identical to what the last run wrote.
+    Returns the number of files written.
+    """
+    written = 0
+    for file in sorted(os.listdir(staging)):
+        dest = f'{outdir}/{file}'
+        key = os.path.relpath(dest, f'{os.getcwd()}/data/processed')
+        digest = file_hash(f'{staging}/{file}')
+        if manifest['files'].get(key) != digest or not os.path.exists(dest):
+            shutil.move(f'{staging}/{file}', dest)
+            manifest['files'][key] = digest
+            written += 1
+    return written
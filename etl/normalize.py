@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+"""
+OBJECTIVE:
+Entity normalization shared by the ETL and the app
+Consolidates the name cols (organization, or last and first name) and location cols (city, state, postal code, country) of each
+contributor, payee or lender prefix, and normalizes names and locations into the lowercased name|location keys counterparties are matched on.
+Names, cities and codes repeat heavily, so each str is built once per distinct value or combination of values and mapped back to the rows
+"""
+
+# Source cols consolidated into {prefix}Name and {prefix}Location, in the order their values are joined
+name_cols = ['NameOrganization', 'NameLast', 'NameFirst']
+location_cols = ['StreetCity', 'StreetStateCd', 'StreetPostalCode', 'StreetCountryCd']
+
+
+
+def unique_rows(cols):
+    """
+    Given equal-length cols, returns the code of each row's combination of values (in order of first appearance)
+    and the values of each distinct combination as object arrays, with '' for missing values.
+    """
+    codes = np.zeros(len(cols[0]), dtype='int64')
+    for col in cols:
+        col_codes, uniques = pd.factorize(col)
+        codes = pd.factorize(codes * (len(uniques) + 1) + col_codes + 1)[0]
+    first = np.empty(codes.max() + 1 if len(codes) > 0 else 0, dtype='int64')
+    first[codes[::-1]] = np.arange(len(codes) - 1, -1, -1)
+    values = []
+    for col in cols:
+        col_values = pd.Series(col).iloc[first].to_numpy(dtype=object)
+        col_values[pd.isna(col_values)] = ''
+        values.append(col_values)
+    return codes, values
+
+
+
+def consolidate_names(organization, last, first):
+    # Organization name if set, else 'Last, First' if both are set, else NaN
+    codes, (last, first) = unique_rows([last, first])
+    people = np.where((last != '') & (first != ''), last + ', ' + first, np.nan)[codes]
+    organization = pd.Series(organization).fillna('').to_numpy(dtype=object)
+    return np.where(organization != '', organization, people)
+
+
+
+def consolidate_locations(city, state, postal_code, country):
+    # 'City, State PostalCode, Country', keeping the separators of blank parts
+    codes, (city, state, postal_code, country) = unique_rows([city, state, postal_code, country])
+    return (city + ', ' + state + ' ' + postal_code + ', ' + country)[codes]
+
+
+
+def consolidate(data, prefixes):
+    """
+    Returns data with the name and location cols of each prefix (e.g. contributor) replaced by {prefix}Name and {prefix}Location,
+    appended after the other cols, dropping all source cols in one step.
+    """
+    entities = {}
+    for prefix in prefixes:
+        entities[f'{prefix}Name'] = consolidate_names(*(data[prefix + col] for col in name_cols))
+    for prefix in prefixes:
+        entities[f'{prefix}Location'] = consolidate_locations(*(data[prefix + col] for col in location_cols))
+    sources = [prefix + col for prefix in prefixes for col in name_cols + location_cols]
+    return pd.concat([data.drop(columns=sources), pd.DataFrame(entities, index=data.index)], axis=1)
+
+
+
+def normalize_values(values):
+    # Lowercased strs with whitespace collapsed, computed once per distinct value
+    codes, uniques = pd.factorize(pd.Series(values).fillna('').astype(str))
+    normalized = pd.Series(uniques, dtype=object).str.lower().str.replace(r'\s+', ' ', regex=True).str.strip().to_numpy(dtype=object)
+    return normalized[codes]
+
+
+
+def entity_keys(names, locations):
+    # 'name|location' keys of counterparties, equal for names and locations differing only in case or spacing
+    return normalize_values(names) + '|' + normalize_values(locations)
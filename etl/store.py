@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype, is_float_dtype, is_integer_dtype, is_bool_dtype
+
+"""
+OBJECTIVE:
+Embedded SQLite store, an optional output target of the ETL next to the per-filer files
+Each var's transactions (view cols), aggregates, balance and filers are bulk-loaded into one table each of a single database file,
+with indexes on filer_ident, dates and counterparty names created after loading, so a filer's rows are an index range scan
+Dates are stored as YYYY-MM-DD strs, which sort like the dates, so date ranges can use the indexes too
+"""
+
+
+
+def column_type(col):
+    # Declared types, so strs that look like numbers (e.g. postal codes) are not converted by SQLite's type affinity
+    if is_bool_dtype(col) or is_integer_dtype(col):
+        return 'INTEGER'
+    if is_float_dtype(col):
+        return 'REAL'
+    return 'TEXT'
+
+
+
+def sql_frame(data):
+    # Dates as YYYY-MM-DD strs (None for missing dates) and categoricals as plain strs
+    cols = {}
+    for col in data.columns:
+        if is_datetime64_any_dtype(data[col]):
+            values = data[col].to_numpy(dtype='datetime64[D]')
+            cols[col] = pd.Series(np.datetime_as_string(values, unit='D'), index=data.index, dtype=object).where(~np.isnat(values), None)
+        elif isinstance(data[col].dtype, pd.CategoricalDtype):
+            cols[col] = data[col].astype(object)
+    return data.assign(**cols)
+
+
+
+class Store:
+    """
+    Loads cleaned dfs into tables of the SQLite database at path, creating each table from the dtypes of its first df.
+    If fresh, an existing database is replaced; otherwise tables are updated in place, clear() removing the rows of rebuilt filers first.
+    """
+
+    def __init__(self, path, fresh=True):
+        self.path = path
+        if fresh and os.path.exists(path):
+            os.remove(path)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.rows = 0
+        self.seconds = 0
+
+    def exists(self, table):
+        return self.connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+    def clear(self, table, changed=None):
+        # Drops table, or on incremental runs (changed set) only the rows of the changed filers
+        start = time.time()
+        with self.connection:
+            if changed is None:
+                self.connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+            elif self.exists(table):
+                self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS changed (filer_ident TEXT PRIMARY KEY)')
+                self.connection.execute('DELETE FROM changed')
+                self.connection.executemany('INSERT OR IGNORE INTO changed VALUES (?)', [(id,) for id in changed])
+                self.connection.execute(f'DELETE FROM "{table}" WHERE filer_ident IN (SELECT filer_ident FROM changed)')
+        self.seconds += time.time() - start
+
+    def write(self, table, data):
+        start = time.time()
+        if len(data) > 0:
+            if not self.exists(table):
+                cols = ', '.join(f'"{col}" {column_type(data[col])}' for col in data.columns)
+                with self.connection:
+                    self.connection.execute(f'CREATE TABLE "{table}" ({cols})')
+            sql_frame(data).to_sql(table, self.connection, if_exists='append', index=False)
+            self.rows += len(data)
+        self.seconds += time.time() - start
+
+    def index(self, table, indexes):
+        # Creates each index (list of cols) of table if missing; on a fresh table this runs once after the bulk load
+        start = time.time()
+        if self.exists(table):
+            with self.connection:
+                for cols in indexes:
+                    name = f'{table}_' + '_'.join(cols)
+                    self.connection.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" (' + ', '.join(f'"{col}"' for col in cols) + ')')
+        self.seconds += time.time() - start
+
+    def close(self):
+        self.connection.close()
+        mb = os.path.getsize(self.path) / 1024**2
+        print(f'Loaded {self.rows:,} rows into {self.path} ({mb:,.1f} MB) in {self.seconds:.1f}s', " "*80)
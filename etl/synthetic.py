@@ -0,0 +1,194 @@
+import argparse
+import os
+import zipfile
+from datetime import date
+import numpy as np
+import pandas as pd
+
+from update_data import contribs_cols, expend_cols, loans_cols, cover_cols
+
+"""
+OBJECTIVE:
+Synthetic TEC_CF_CSV.zip for benchmarking the ETL and the app offline, at any scale
+Writes filers.csv, cover.csv, contribs_*.csv and expend_*.csv members of at most member_rows rows each and loans.csv, with the TEC's cols and YYYYMMDD dates.
+Filer sizes are skewed (a few filers hold most transactions), counterparties come from a shared pool with a popular head (so filers share
+contributors and payees) plus each filer's own regulars, and names, cities and codes repeat with TEC-like cardinalities
+Run from the repo root: python etl/synthetic.py .cache/benchmark/TEC_CF_CSV.zip --filers 2000 --rows 1000000
+"""
+
+filer_cols = ['filerIdent', 'filerTypeCd', 'filerPersentTypeCd', 'filerName', 'filerFilerpersStatusCd', 'filerHoldOfficeCd',
+    'filerHoldOfficeDistrict', 'contestSeekOfficeCd', 'contestSeekOfficeDistrict', 'filerEffStartDt', 'filerEffStopDt']
+last_names = ['Smith', 'Johnson', 'Garcia', 'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Williams', 'Brown', 'Jones', "O'Neil", 'De La Cruz']
+first_names = ['James', 'Mary', 'Robert', 'Patricia', 'Jose', 'Maria', 'Michael', 'Linda', 'David', 'Elizabeth', 'Juan', 'Ann']
+cities = [('AUSTIN', '787'), ('HOUSTON', '770'), ('DALLAS', '752'), ('SAN ANTONIO', '782'), ('EL PASO', '799'), ('FORT WORTH', '761'),
+    ('Round Rock', '786'), ('Sugar Land', '774'), ('Plano', '750'), ('Lubbock', '794')]
+# First and last day of the transactions, as days since 1970-01-01
+first_day = (date(2000, 1, 1) - date(1970, 1, 1)).days
+last_day = (date.today() - date(1970, 1, 1)).days
+
+
+
+def date_strs(days):
+    # YYYYMMDD strs of days since 1970-01-01, formatted once per distinct day
+    uniques, inverse = np.unique(days, return_inverse=True)
+    return pd.to_datetime(uniques, unit='D').strftime('%Y%m%d').to_numpy(dtype=object)[inverse]
+
+
+
+def skewed(rng, n, size, a=1.1):
+    # n draws of 0..size-1 with P(k) ~ 1 / (k + 1)**a, so the first values are by far the most frequent
+    weights = 1 / np.arange(1, size + 1) ** a
+    return rng.choice(size, n, p=weights / weights.sum())
+
+
+
+def make_filers(rng, filers):
+    """
+    Returns filers.csv rows: one per filer ident, plus older records of some filers under another name and a few "do not use" records.
+    Candidates are individuals named Last, First, committees (PACs) are entities.
+    """
+    ids = np.char.zfill(np.arange(1, filers + 1).astype(str), 8)
+    entity = rng.random(filers) < .4
+    names = np.where(entity, [f'Texans for Progress {i} PAC' for i in range(filers)],
+        [f'{last_names[i % len(last_names)]} {i}, {first_names[i % len(first_names)]}' for i in range(filers)])
+    data = pd.DataFrame({
+        'filerIdent': ids,
+        'filerTypeCd': np.where(entity, rng.choice(['GPAC', 'SPAC', 'MPAC'], filers), rng.choice(['COH', 'JCOH', 'CEC'], filers)),
+        'filerPersentTypeCd': np.where(entity, 'ENTITY', 'INDIVIDUAL'),
+        'filerName': names,
+        'filerFilerpersStatusCd': rng.choice(['CURRENT', 'NOT_OF_RECORD', 'TERMINATED'], filers, p=[.6, .3, .1]),
+        'filerHoldOfficeCd': np.where(entity, '', rng.choice(['STATEREP', 'STATESEN', 'DISTJUDGE', ''], filers)),
+        'filerHoldOfficeDistrict': np.where(entity, '', rng.integers(1, 150, filers).astype(str)),
+        'contestSeekOfficeCd': np.where(entity, '', rng.choice(['STATEREP', 'STATESEN', ''], filers)),
+        'contestSeekOfficeDistrict': '',
+        'filerEffStartDt': date_strs(rng.integers(first_day - 3650, last_day, filers)),
+        'filerEffStopDt': '',
+    })
+    renamed = data.sample(frac=.05, random_state=0).assign(filerName=lambda frame: frame.filerName + ' Old', filerEffStartDt='19950101')
+    unused = data.sample(frac=.005, random_state=1).assign(filerName='DO NOT USE', filerEffStartDt='19900101')
+    return pd.concat([unused, renamed, data], ignore_index=True)[filer_cols]
+
+
+
+def make_counterparties(rng, size):
+    # Pool of counterparties: people from a few thousand last and first names and organizations, each with a TX-heavy location
+    people = rng.random(size) < .8
+    city = rng.integers(0, len(cities), size)
+    return pd.DataFrame({
+        'PersentTypeCd': np.where(people, 'INDIVIDUAL', 'ENTITY'),
+        'NameOrganization': np.where(people, '', np.char.add('Acme Holdings ', (np.arange(size) % 5000).astype(str))),
+        'NameLast': np.where(people, np.char.add(np.array(last_names)[np.arange(size) % len(last_names)], np.char.add(' ', rng.integers(0, 3000, size).astype(str))), ''),
+        'NameFirst': np.where(people, np.array(first_names)[rng.integers(0, len(first_names), size)], ''),
+        'StreetCity': np.array([name for name, _ in cities])[city],
+        'StreetPostalCode': np.char.add(np.array([zip3 for _, zip3 in cities])[city], np.char.zfill(rng.integers(0, 100, size).astype(str), 2)),
+        'StreetStateCd': rng.choice(['TX', 'CA', 'NY', ''], size, p=[.9, .04, .03, .03]),
+        'StreetCountryCd': rng.choice(['USA', ''], size, p=[.97, .03]),
+        'Employer': rng.choice(['', 'Self', 'Retired', 'Dell', 'H-E-B', 'University Of Texas'], size),
+    })
+
+
+
+def make_transactions(rng, n, var, filers, pool):
+    """
+    Returns n rows of contribs, expend or loans members. Filers are drawn with skewed sizes; each row's counterparty is either
+    a popular one from the shared pool or one of the filer's own regulars. Transaction dates precede the received date,
+    a few are blank or mistyped into the future.
+    """
+    cols, prefix, record, amount, datecol = {
+        'contribs': (contribs_cols, 'contributor', 'RCPT', 'contributionAmount', 'contributionDt'),
+        'expend': (expend_cols, 'payee', 'EXPN', 'expendAmount', 'expendDt'),
+        'loans': (loans_cols, 'lender', 'LOAN', 'loanAmount', 'loanDt'),
+    }[var]
+    filer = skewed(rng, n, len(filers))
+    shared = skewed(rng, n, len(pool), a=1.2)
+    regular = (filer * 7919 + rng.integers(0, 200, n)) % len(pool)
+    counterparty = pool.iloc[np.where(rng.random(n) < .5, shared, regular)].reset_index(drop=True)
+
+    received = rng.integers(first_day, last_day, n)
+    transacted = received - rng.integers(0, 180, n)
+    transacted = np.where(rng.random(n) < .0005, transacted + 365 * 200, transacted)
+    data = pd.DataFrame({
+        'recordType': record,
+        'reportInfoIdent': (filer * 1000 + (received - first_day) // 180).astype(str),
+        'infoOnlyFlag': rng.choice(['N', 'Y'], n, p=[.97, .03]),
+        'filerIdent': filers[filer],
+        'receivedDt': date_strs(received),
+        datecol: np.where(rng.random(n) < .005, '', date_strs(transacted)),
+        amount: rng.lognormal(4.5, 1.5, n).round(2).astype(str),
+        'loanInfoId': rng.integers(1, 10**6, n).astype(str),
+        f'{prefix}LawFirmName': np.where(rng.random(n) < .02, 'Baker Botts Llp', ''),
+        'contributionDescr': rng.choice(['', '', 'In-kind: food', 'Tickets, dinner'], n),
+        'expendDescr': rng.choice(['Advertising', 'Consulting', 'Food & beverage', 'Travel', 'Postage'], n),
+        'expendCatCd': rng.choice(['ADVERT', 'CONSULT', 'FOOD', 'TRAVEL', 'OFFICE', 'FEES', 'SALARY', 'EVENT'], n),
+        'expendCatDescr': np.where(rng.random(n) < .1, 'Other', ''),
+        'politicalExpendCd': rng.choice(['Y', 'N', ''], n, p=[.7, .2, .1]),
+    })
+    for col in counterparty.columns:
+        data[prefix + col] = counterparty[col].to_numpy()
+    return data[cols]
+
+
+
+def make_cover(rng, filers, reports):
+    # Semiannual reports of each filer (more for larger filers), some corrected the same day, with balance amounts
+    filer = skewed(rng, reports, len(filers), a=.8)
+    received = rng.integers(first_day, last_day, reports)
+    corrected = rng.random(reports) < .05
+    filer, received = np.concatenate([filer, filer[corrected]]), np.concatenate([received, received[corrected]])
+    n = len(filer)
+    data = pd.DataFrame({
+        'filerIdent': filers[filer],
+        'filerName': 'Synthetic Filer',
+        'periodStartDt': date_strs(received - 190),
+        'periodEndDt': date_strs(received - 10),
+        'receivedDt': date_strs(received),
+        'timelyCorrectionFlag': np.where(np.arange(n) >= reports, 'Y', 'N'),
+        'infoOnlyFlag': rng.choice(['N', 'Y'], n, p=[.97, .03]),
+    })
+    for col in cover_cols[7:]:
+        data[col] = np.where(rng.random(n) < .3, np.nan, rng.lognormal(7, 2, n).round(2))
+    return data[cover_cols]
+
+
+
+def write_members(zf, rng, var, rows, member_rows, filers, pool, numbered=True):
+    # Writes rows of var as {var}_01.csv, {var}_02.csv, ... (or {var}.csv) members of at most member_rows rows each
+    members = max(-(-rows // member_rows), 1)
+    for i in range(members):
+        n = min(member_rows, rows - i * member_rows)
+        name = f'{var}_{i + 1:02d}.csv' if numbered else f'{var}.csv'
+        with zf.open(name, 'w', force_zip64=True) as f:
+            f.write(make_transactions(rng, n, var, filers, pool).to_csv(index=False).encode('utf-8'))
+        print(f'\tWrote {name} ({n:,} rows)', " "*80, end='\r')
+
+
+
+def make_tec_zip(path, filers=2000, rows=1000000, member_rows=500000, seed=0):
+    """
+    Writes a synthetic TEC zip to path with filers filer idents and rows contributions, half as many expenditures
+    and a fiftieth as many loans, split into members of at most member_rows rows.
+    """
+    rng = np.random.default_rng(seed)
+    filer_data = make_filers(rng, filers)
+    ids = filer_data.filerIdent.unique()
+    pool = make_counterparties(rng, max(rows // 15, 1000))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        zf.writestr('filers.csv', filer_data.to_csv(index=False))
+        zf.writestr('cover.csv', make_cover(rng, ids, filers * 12).to_csv(index=False))
+        write_members(zf, rng, 'contribs', rows, member_rows, ids, pool)
+        write_members(zf, rng, 'expend', rows // 2, member_rows, ids, pool)
+        write_members(zf, rng, 'loans', max(rows // 50, 1), rows, ids, pool, numbered=False)
+    print(f'Wrote {path} ({os.path.getsize(path) / 1024**2:,.1f} MB)', " "*80)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes a synthetic TEC campaign finance zip')
+    parser.add_argument('path', help='Zip file to write')
+    parser.add_argument('--filers', type=int, default=2000, help='Number of filer idents (default: 2000)')
+    parser.add_argument('--rows', type=int, default=1000000, help='Number of contributions; expenditures are half and loans a fiftieth of it (default: 1000000)')
+    parser.add_argument('--member-rows', type=int, default=500000, help='Max rows of each contribs/expend member (default: 500000)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    make_tec_zip(args.path, args.filers, args.rows, args.member_rows, args.seed)
@@ -1,13 +1,25 @@
 import os 
-import requests
 from datetime import date, datetime, timezone, timedelta
 import numpy as np
 import pandas as pd
-from datetime import date
-from io import BytesIO
 import re
+import resource
 import time
-from zipfile import ZipFile
+import argparse
+import pickle
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from download import download_zip, open_zip
+from filer_index import export_filer_index
+from counterparty_index import make_counterparty_index, index_table, export_counterparty_index
+from store import Store
+from instrument import Stages, peak_rss_mb, process_peak_mb
+from normalize import consolidate
+from dates import parse_dates, parse_date_cols
+from balance import cover_hashes, changed_hashes, balance_series, balance_summary
+from manifest import load_manifest, save_manifest, member_checksum, filer_hashes, stale_filers, changed_filers, record_members, remove_stale_files, publish_files
 
 """
 OBJECTIVE:
@@ -40,6 +52,16 @@ cover_cols = ['filerIdent', 'filerName', 'periodStartDt', 'periodEndDt', 'receiv
         'contribsMaintainedAmount', # positive
         'unitemizedLoanAmount', # negative
         'totalInterestEarnedAmount'] # positive
+# Low-cardinality code cols stored as categoricals rather than one Python str per row
+code_cols = ['recordType', 'infoOnlyFlag', 'filerTypeCd', 'filerPersentTypeCd', 'filerFilerpersStatusCd', 'filerHoldOfficeCd', 'contestSeekOfficeCd']
+# Numeric idents, documented as numbers in CFS-ReadMe.txt (filerIdent is documented as a str and keeps its leading zeros)
+int_cols = ['reportInfoIdent', 'loanInfoId']
+# Counterparties kept per filer and year in the top counterparties aggregate
+top_n = 10
+# Max rows of a row group of the per-filer Parquet files, which most filers fit in one of
+parquet_row_group_rows = 100000
+# Joined filer cols kept in the {var}_{id}_view files the app reads (the rest repeat filers.csv on every row)
+view_filer_cols = ['filer_ident', 'filer_name']
 colsort_dict = {'status': 7, 'type': 6, 'employer': 5, 'name_organization': 4,  'name': 3, 'ident': 2, 'record': 1, 'report': 0}
 
 
@@ -53,10 +75,8 @@ def sorted_cols(el):
 
 
 
-def clean_date(date, comp_date):
-    if date > date.today():
-        date = pd.Timestamp(comp_date.year, date.month, date.day)
-    return date
+def snake_case(col):
+    return re.sub( '(?<!^)(?=[A-Z])', '_', col.replace('Cd', '')).lower()
 
 
 
@@ -68,141 +88,829 @@ def make_sorted_cols(data):
 
 
 
-def clean_filer_data(file):
-    filers = pd.read_csv(file, dtype=str, parse_dates=['filerEffStartDt', 'filerEffStopDt'])\
-        [['filerIdent', 'filerTypeCd', 'filerPersentTypeCd', 'filerName', 'filerFilerpersStatusCd', 'filerHoldOfficeCd',  # Removed 'filerStreetPostalCode', 'filerStreetStateCd', 'filerStreetCountryCd'
-        'filerHoldOfficeDistrict', 'contestSeekOfficeCd', 'contestSeekOfficeDistrict', 'filerEffStartDt', 'filerEffStopDt']]\
-        .sort_values('filerEffStartDt')\
-        .fillna('')
-    filers.filerName = filers.filerName.str.strip()
+def view_cols(cols):
+    # Cols of a cleaned var df without the joined filer and office cols
+    return [col for col in cols if ('filer' not in col or col in view_filer_cols) and 'office' not in col]
+
+
+
+def filer_partitions(filers):
+    # Filer name (lowercased) each ident's rows are exported with, used by the app to skip files of idents now filed under another name
+    return dict(zip(filers.filerIdent, clean_strs(fill_blank(filers.filerName), strip_punct=False).str.lower()))
+
+
+
+def make_dtypes(cols):
+    """
+    Returns read_csv dtypes for cols: categoricals for codes, floats for amounts, nullable ints for numeric idents and strs for the rest.
+    """
+    dtypes = {}
+    for col in cols:
+        if col in code_cols or col.endswith('Cd'):
+            dtypes[col] = 'category'
+        elif col.endswith('Amount'):
+            dtypes[col] = 'float64'
+        elif col in int_cols:
+            dtypes[col] = 'Int64'
+        else:
+            dtypes[col] = str
+    return dtypes
+
+
+
+def fill_blank(col):
+    # fillna('') for str and categorical cols alike
+    if isinstance(col.dtype, pd.CategoricalDtype) and '' not in col.cat.categories:
+        col = col.cat.add_categories('')
+    return col.fillna('')
+
+
+
+def clean_filer_data(file, stages=None):
+    if stages is None:
+        stages = Stages()
+    filer_cols = ['filerIdent', 'filerTypeCd', 'filerPersentTypeCd', 'filerName', 'filerFilerpersStatusCd', 'filerHoldOfficeCd',  # Removed 'filerStreetPostalCode', 'filerStreetStateCd', 'filerStreetCountryCd'
+        'filerHoldOfficeDistrict', 'contestSeekOfficeCd', 'contestSeekOfficeDistrict', 'filerEffStartDt', 'filerEffStopDt']
+    with stages.stage('filers/read_csv') as stage:
+        filers = pd.read_csv(file, usecols=filer_cols, dtype=make_dtypes(filer_cols), parse_dates=['filerEffStartDt', 'filerEffStopDt'])\
+            [filer_cols]\
+            .sort_values('filerEffStartDt')
+        stage['rows_out'] = len(filers)
+    with stages.stage('filers/clean', len(filers)):
+        for col in filers.columns:
+            filers[col] = fill_blank(filers[col])
+        filers.filerName = filers.filerName.str.strip()
 
     return filers
 
 
 
-def clean_and_export_vardata(var, zf, filers, filenames, cols, datecols):
+def clean_strs(col, strip_punct=True):
     """
-    Given series of filenames or filename patterns for a var (e.g. contributions), 
-    reads and merges each df with filers df, concatenates dfs, and exports last five years of data for that var.
+    Title-cases a str col, replaces tabs and line breaks with spaces, drops non-alphanumeric chars and strips it.
+    Without strip_punct (filer cols), values are only title-cased and stripped, so filer names still equal the names of filers.csv
+    and filers_index.json once lowercased, as the app compares them. Names, cities and codes repeat heavily, so the cleaning runs once per unique value and is mapped back to the rows.
     """
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        # Cleaning the categories only, merging those that become equal
+        if len(col.cat.categories) == 0:
+            return col
+        categories, inverse = np.unique(clean_values(col.cat.categories, strip_punct), return_inverse=True)
+        codes = col.cat.codes.to_numpy()
+        return pd.Series(pd.Categorical.from_codes(np.where(codes >= 0, inverse[codes], -1), categories), index=col.index)
+
+    codes, uniques = pd.factorize(col, sort=False)
+    return pd.Series(clean_values(uniques, strip_punct)[codes], index=col.index, dtype=object)
 
-    print(f'Cleaning and exporting {var}', " "*80)
-    
-    # Retrieving filenames and concatenating dfs
-    dfs = []
 
-    date_parser = lambda date: pd.to_datetime(date, errors='coerce')
 
+def clean_values(values, strip_punct=True):
+    cleaned = pd.Series(values, dtype=object).str.title()
+    if not strip_punct:
+        return cleaned.str.strip().to_numpy()
+    cleaned = cleaned.str.replace(r'[\r\n\t]+', ' ', regex=True).str.replace(r'[^A-Za-z0-9 ]+', '', regex=True)
+    return cleaned.str.replace(r' {2,}', ' ', regex=True).str.strip().to_numpy()
+
+
+
+def list_members(zf, filenames):
+    """
+    Given series of filenames or filename patterns (e.g. contribs_*.csv), returns matching zip members in archive order.
+    """
+    members = []
     for filename in filenames:
         if '*' in filename:
             start, end = filename.split('*')
-            files = [file for file in zf.namelist() if file.startswith(start) and file.endswith(end)]
-            for file in files:
-                print('\tLoading', file.split('/')[-1], " "*80, end='\r')
-                df = pd.read_csv(zf.open(file), usecols=cols, dtype=str, parse_dates=datecols, date_parser=date_parser)
-                df = df.merge(filers, on='filerIdent', how='left')
-                dfs.append(df)
+            members += [file for file in zf.namelist() if file.startswith(start) and file.endswith(end)]
         else:
-            print('\tLoading', filename.split('/')[-1], " "*80, end='\r')
-            df = pd.read_csv(zf.open(filename), usecols=cols, dtype=str, parse_dates=datecols, date_parser=date_parser)
-            df = df.merge(filers, on='filerIdent', how='left')
-            dfs.append(df)
-    print('\tConcatenating files', " "*80, end='\r')
-    data = pd.concat(dfs, ignore_index=True)
+            members.append(filename)
+    return members
 
 
+
+def read_vardata(zf, members, cols, chunksize=None):
+    """
+    Yields (member, raw df) for a var, one per zip member or, if chunksize is set, one per chunk of at most chunksize rows.
+    Dates are left as strs for parse_date_cols.
+    """
+    for file in members:
+        print('\tLoading', file.split('/')[-1], " "*80, end='\r')
+        reader = pd.read_csv(zf.open(file), usecols=cols, dtype=make_dtypes(cols), chunksize=chunksize)
+        if chunksize is None:
+            yield file, reader
+        else:
+            for chunk in reader:
+                yield file, chunk
+
+
+
+def clean_vardata(data, stages=None):
+    """
+    Cleans strs of a var df (whole file or chunk) merged with filers df, consolidates name and location cols and cleans col names.
+    Each step is timed in stages, if passed.
+    """
+    if stages is None:
+        stages = Stages()
+
     # Filling NAs and cleaning strs
-    print('\tFilling NAs and cleaning strs', " "*80, end='\r')
-    obj_cols = [col for col in data.columns if 'Amount' not in col and 'Id' not in col and 'Dt' not in col]
-    for col in obj_cols:
-        data[col] = data[col].fillna('')
-        if 'Type' not in col:
-            data[col] = data[col].apply(lambda x: x.title().replace(r'\r+|\n+|\t+','').replace(r'[^A-Za-z0-9 ]+', '').strip())
-    data = data[data.infoOnlyFlag == 'N']
-
-    # Consolidating name cols
-    print('\tConsolidating name cols', " "*80, end='\r')
-    namecolprefixls = [col.split('NameFirst')[0] for col in data.columns if 'NameFirst' in col]
-    for prefix in namecolprefixls:
-        data[prefix + 'Name'] = np.where(
-            (data[prefix + 'NameLast'] != '') & (data[prefix + 'NameFirst'] != '') &
-            (data[prefix + 'NameLast'] + data[prefix + 'NameFirst'] != np.nan),
-            data[prefix + 'NameLast'] + ', ' + data[prefix + 'NameFirst'],
-            np.nan)
-        data[prefix + 'Name'] = data[prefix + 'Name'].str.strip()
-        data.drop(columns=[prefix + 'NameLast', prefix + 'NameFirst'], inplace=True)
-        data[prefix + 'Name'] = np.where(data[prefix + 'NameOrganization'] != '', data[prefix + 'NameOrganization'], data[prefix + 'Name'])
-        data.drop(columns=[prefix + 'NameOrganization'], inplace=True)
-
-    # Consolidating location cols
-    location_cols = [f'{prefix}StreetCity', f'{prefix}StreetStateCd', f'{prefix}StreetPostalCode', f'{prefix}StreetCountryCd']
-    data[location_cols] = \
-        data[location_cols].fillna('').astype(str)
-    data[f'{prefix}Location'] = data[f'{prefix}StreetCity'] + ', ' + data[f'{prefix}StreetStateCd'] + ' ' + \
-        data[f'{prefix}StreetPostalCode'] + ', ' + data[f'{prefix}StreetCountryCd']
-    data.drop(columns=location_cols, inplace=True)
+    with stages.stage('clean strs', len(data)):
+        obj_cols = [col for col in data.columns if 'Amount' not in col and 'Id' not in col and 'Dt' not in col]
+        for col in obj_cols:
+            data[col] = fill_blank(data[col])
+            if 'Type' not in col:
+                # Filer cols keep their punctuation so names still match filers.csv in the app
+                data[col] = clean_strs(data[col], strip_punct=not col.startswith('filer'))
+
+    # Consolidating name and location cols of each prefix (e.g. contributor)
+    with stages.stage('consolidate entities', len(data)):
+        data = consolidate(data, [col.split('NameFirst')[0] for col in data.columns if 'NameFirst' in col])
 
     # Cleaning col names
-    print('\tCleaning col names', " "*80, end='\r')
-    data.columns = [re.sub( '(?<!^)(?=[A-Z])', '_', col.replace('Cd', '')).lower() for col in data.columns]
+    data.columns = [snake_case(col) for col in data.columns]
     data = make_sorted_cols(data)
 
+    return data
+
+
+
+class PartitionWriter:
+    """
+    Routes rows of cleaned dfs to per-filer files {outdir}/{var}_{id}{suffix}.csv, creating each file on its first write in the run and appending after.
+    Each df is sorted once by filer_ident and rendered with a single to_csv call, then split into per-filer slices that are encoded
+    as UTF-8 and written with one buffered write per file. With threads > 1, writes run on that many writer threads, each owning a fixed share of the files
+    so appends to a file keep their order, and write waits for the oldest writes once more than max_pending bytes are queued.
+    If parquet, each df is also converted to Arrow with arrow_table and appended to a temp stream of its bucket of filer idents,
+    and write_parquet writes each filer's {var}_{id}{suffix}.parquet from its bucket with write_parquet_file once every df is written,
+    since a filer's rows arrive over many dfs and a Parquet file cannot be appended to.
+    """
+
+    def __init__(self, var, outdir, threads=1, suffix='', max_pending=16 * 1024**2, parquet=False, buckets=64):
+        self.var = var
+        self.outdir = outdir
+        self.suffix = suffix
+        self.parquet = parquet
+        self.buckets = buckets
+        self.streams = {}
+        self.spill = tempfile.TemporaryDirectory() if parquet else None
+        self.written = set()
+        self.writes = 0
+        self.bytes = 0
+        self.seconds = 0
+        self.thread_count = max(threads, 1)
+        self.threads = [ThreadPoolExecutor(1) for _ in range(threads)] if threads > 1 else []
+        self.futures = deque()
+        self.max_pending = max_pending
+        self.pending = 0
+
+    def render(self, data):
+        # Yields (filer ident, header, csv text) for each filer in data
+        data = data.sort_values('filer_ident', kind='stable')
+        ids = data.filer_ident.to_numpy()
+        bounds = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+        starts, ends = [0, *bounds], [*bounds, len(data)]
+        header = data.iloc[:0].to_csv(index=False)
+        lines = data.to_csv(index=False, header=False).split(os.linesep)
+
+        # Line breaks inside quoted values would shift the slices, so falling back to one to_csv call per filer
+        if len(lines) != len(data) + 1:
+            for start, end in zip(starts, ends):
+                yield ids[start], header, data.iloc[start:end].to_csv(index=False, header=False)
+            return
+        for start, end in zip(starts, ends):
+            yield ids[start], header, os.linesep.join(lines[start:end]) + os.linesep
+
+    def write(self, data):
+        start = time.time()
+        if len(data) > 0:
+            for id, header, text in self.render(data):
+                path = f'{self.outdir}/{self.var}_{id}{self.suffix}.csv'
+                if id in self.written:
+                    mode = 'a'
+                else:
+                    mode, text = 'w', header + text
+                    self.written.add(id)
+                # Encoded here so bytes and pending count bytes, written in binary mode so line ends stay os.linesep like to_csv's
+                content = text.encode('utf-8')
+                self.writes += 1
+                self.bytes += len(content)
+                if self.threads:
+                    self.futures.append((self.threads[hash(id) % len(self.threads)].submit(write_file, path, mode + 'b', content), len(content)))
+                    self.pending += len(content)
+                else:
+                    write_file(path, mode + 'b', content)
+            while self.pending > self.max_pending:
+                future, size = self.futures.popleft()
+                future.result()
+                self.pending -= size
+            if self.parquet:
+                self.spill_arrow(data)
+        self.seconds += time.time() - start
+
+    def spill_arrow(self, data):
+        # Appends data's rows to the Arrow stream of each filer's bucket, keeping their order within a bucket
+        import pyarrow as pa
+
+        codes, ids = pd.factorize(data.filer_ident)
+        buckets = np.array([hash(id) % self.buckets for id in ids])[codes]
+        order = np.argsort(buckets, kind='stable')
+        table, buckets = arrow_table(data).take(order), buckets[order]
+        cuts = np.flatnonzero(np.diff(buckets)) + 1
+        for start, end in zip([0, *cuts], [*cuts, len(table)]):
+            bucket = buckets[start]
+            if bucket not in self.streams:
+                self.streams[bucket] = pa.ipc.new_stream(f'{self.spill.name}/{bucket}.arrow', table.schema)
+            self.streams[bucket].write_table(table.slice(start, end - start))
+
+    def write_parquet(self):
+        # Writes each filer's Parquet copy from the spilled buckets with write_parquet_file, on the writer threads
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        with ThreadPoolExecutor(self.thread_count) as pool:
+            for bucket, stream in sorted(self.streams.items()):
+                stream.close()
+                with pa.memory_map(f'{self.spill.name}/{bucket}.arrow') as source:
+                    table = pa.ipc.open_stream(source).read_all()
+                table = table.take(pc.sort_indices(table, sort_keys=[('filer_ident', 'ascending')]))
+                ids = table['filer_ident'].to_numpy(zero_copy_only=False)
+                bounds = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+                futures = [pool.submit(write_parquet_file, f'{self.outdir}/{self.var}_{ids[start]}{self.suffix}.parquet',
+                    table.slice(start, end - start)) for start, end in zip([0, *bounds], [*bounds, len(table)])]
+                for future in futures:
+                    future.result()
+        self.streams = {}
+        self.spill.cleanup()
+
+    def close(self):
+        start = time.time()
+        for future, _ in self.futures:
+            future.result()
+        for thread in self.threads:
+            thread.shutdown()
+        self.seconds += time.time() - start
+        seconds = max(self.seconds, 1e-9)
+        mb = self.bytes / 1024**2
+        print(f'\tWrote {len(self.written):,} files ({self.writes:,} writes, {mb:,.1f} MB) in {self.seconds:.1f}s: ' + \
+            f'{len(self.written) / seconds:,.0f} files/s, {mb / seconds:,.1f} MB/s', " "*80)
+
+
+
+def write_file(path, mode, content):
+    with open(path, mode, buffering=1024**2) as f:
+        f.write(content)
+
+
+
+def write_parquet_file(path, data):
+    # Writes an Arrow table to path in row groups of up to parquet_row_group_rows rows (the app reads whole files, so fewer groups mean smaller, faster files)
+    import pyarrow.parquet as pq
+
+    pq.write_table(data, path, row_group_size=parquet_row_group_rows, use_dictionary=True, compression='snappy')
+
+
+
+class Aggregator:
+    """
+    Builds per-filer aggregates for the app's stats panels from cleaned dfs, one chunk at a time:
+    monthly totals and counts, yearly totals, counts and largest amount per counterparty (all cols starting with prefix),
+    and the top_n counterparties per year by largest amount. Partial aggregates are spilled to a temp dir whenever more than spill_rows
+    are held, split into buckets of filer idents, and export re-aggregates batches of buckets of at most batch_bytes of spilled partials,
+    so memory holds a chunk's or a batch's partials rather than the whole var's.
+    Buckets are ranges of filer idents cut from ids (the var's filer idents) and from the rows of the first chunk, so large filers
+    get buckets of their own. Each batch's counterparties are indexed into an index_table, kept in index.
+    """
+
+    def __init__(self, prefix, datecol, amountcol, ids, buckets=64, spill_rows=100000, batch_bytes=8 * 1024**2):
+        self.prefix = prefix
+        self.datecol = datecol
+        self.amountcol = amountcol
+        self.ids = np.unique(np.asarray(ids, dtype=str)).astype(object)
+        self.buckets = buckets
+        self.spill_rows = spill_rows
+        self.batch_bytes = batch_bytes
+        self.bounds = None
+        self.spill = tempfile.TemporaryDirectory()
+        self.parts = {'monthly': [], 'counterparties': []}
+        self.index = []
+
+    def cut(self, ids):
+        # Bucket bounds: every len / buckets-th of the sorted ids, keeping the first bucket open below
+        ids = np.sort(np.asarray(ids, dtype=object))
+        return ids[::max(len(ids) // self.buckets, 1)][1:]
+
+    def add(self, data):
+        if len(data) == 0:
+            return
+        keys = [col for col in data.columns if col.startswith(self.prefix)]
+        frame = data[['filer_ident', 'filer_name', *keys]].astype(object).fillna('')
+        if self.bounds is None:
+            self.bounds = np.unique(np.concatenate([self.cut(self.ids), self.cut(frame.filer_ident.to_numpy())]))
+        frame['year'] = data[self.datecol].dt.year.astype('Int64')
+        frame['month'] = data[self.datecol] + pd.offsets.MonthEnd(0)
+        frame['amount'] = data[self.amountcol]
+
+        self.parts['monthly'].append(frame.groupby(['filer_ident', 'filer_name', 'year', 'month']).amount.agg(amount='sum', count='count').reset_index())
+        self.parts['counterparties'].append(frame.groupby(['filer_ident', 'filer_name', 'year', *keys]).amount\
+            .agg(amount='sum', count='size', max_amount='max').reset_index())
+        if sum(len(part) for part in self.parts['counterparties']) > self.spill_rows:
+            self.dump()
+
+    def dump(self):
+        # Appends the held partials to the spill file of each bucket, keeping chunk order within a bucket
+        for name, parts in self.parts.items():
+            if not parts:
+                continue
+            part = pd.concat(parts, ignore_index=True)
+            buckets = np.searchsorted(self.bounds, part.filer_ident.to_numpy(), side='right')
+            order = np.argsort(buckets, kind='stable')
+            part, buckets = part.iloc[order], buckets[order]
+            cuts = np.flatnonzero(np.diff(buckets)) + 1
+            for start, end in zip([0, *cuts], [*cuts, len(part)]):
+                with open(f'{self.spill.name}/{name}_{buckets[start]}.pkl', 'ab') as f:
+                    pickle.dump(part.iloc[start:end], f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.parts[name] = []
+
+    def spilled(self, bucket):
+        # Bytes spilled to a bucket
+        paths = [f'{self.spill.name}/{name}_{bucket}.pkl' for name in ['monthly', 'counterparties']]
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+    def load(self, name, batch):
+        # Partials spilled to a batch of buckets, in bucket and chunk order, None if there are none
+        parts = []
+        for bucket in batch:
+            path = f'{self.spill.name}/{name}_{bucket}.pkl'
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                while True:
+                    try:
+                        parts.append(pickle.load(f))
+                    except EOFError:
+                        break
+            os.remove(path)
+        return pd.concat(parts, ignore_index=True) if parts else None
+
+    def batches(self):
+        # Consecutive buckets grouped up to batch_bytes of spilled partials (at least one bucket each)
+        batch, size = [], 0
+        for bucket in range(len(self.bounds) + 1 if self.bounds is not None else 0):
+            spilled = self.spilled(bucket)
+            if batch and size + spilled > self.batch_bytes:
+                yield batch
+                batch, size = [], 0
+            batch.append(bucket)
+            size += spilled
+        if batch:
+            yield batch
+
+    def export(self, var, outdir, threads=1, store=None):
+        # Writes the _monthly, _counterparties and _top files (and store tables) batch by batch, indexing each batch's counterparties
+        self.dump()
+        writers = {suffix: PartitionWriter(var, outdir, threads, suffix) for suffix in ['_monthly', '_counterparties', '_top']}
+        for batch in self.batches():
+            monthly, counterparties = self.load('monthly', batch), self.load('counterparties', batch)
+            tables = []
+            if monthly is not None:
+                tables.append(('_monthly', monthly.groupby(list(monthly.columns[:-2])).agg(amount=('amount', 'sum'), count=('count', 'sum')).reset_index()))
+            if counterparties is not None:
+                counterparties = counterparties.groupby(list(counterparties.columns[:-3]))\
+                    .agg(amount=('amount', 'sum'), count=('count', 'sum'), max_amount=('max_amount', 'max')).reset_index()
+                self.index.append(index_table(make_counterparty_index(counterparties, self.prefix)))
+                counterparties = counterparties.sort_values(['filer_ident', 'year', 'amount'], ascending=[True, True, False])
+                top = counterparties.sort_values(['filer_ident', 'year', 'max_amount'], ascending=[True, True, False]).groupby(['filer_ident', 'year']).head(top_n)
+                tables += [('_counterparties', counterparties), ('_top', top)]
+            for suffix, table in tables:
+                writers[suffix].write(table)
+                if store is not None:
+                    store.write(f'{var}{suffix}', table)
+        for writer in writers.values():
+            writer.close()
+        self.spill.cleanup()
+
+
+
+def arrow_table(data):
+    """
+    Arrow table of a cleaned df with the types of the per-filer Parquet files: datetimes for _dt cols, floats for amounts and balance,
+    and strs for the rest (as written to the CSVs, with blanks as nulls).
+    """
+    import pyarrow as pa
+
+    cols, fields = {}, []
+    for col in data.columns:
+        values = data[col]
+        if col.endswith('_dt'):
+            cols[col], type = pd.to_datetime(values, errors='coerce'), pa.timestamp('ns')
+        elif col.endswith('_amount') or col == 'balance':
+            cols[col], type = pd.to_numeric(values, errors='coerce').astype(float), pa.float64()
+        else:
+            if values.dtype != object:
+                values = values.astype('string').astype(object)
+            cols[col], type = values.where(~(values.isna() | values.isin([''])), None), pa.string()
+        fields.append((col, type))
+    # Without pandas' metadata, which read_parquet does not need for these types and which doubled the footer of small files
+    return pa.Table.from_pandas(pd.DataFrame(cols), schema=pa.schema(fields), preserve_index=False).replace_schema_metadata(None)
+
+
+
+def filter_rows(chunk, datecol, since=None, changed=None):
+    """
+    Drops rows that would be discarded after cleaning anyway, right after parsing: info-only rows, rows dated before the since year (if set)
+    and rows of filers not in changed (if set). Returns the filtered df and a dict of row counts left after each filter.
+    """
+    counts = {'read': len(chunk)}
+    chunk = chunk[chunk.infoOnlyFlag == 'N']
+    counts['not info-only'] = len(chunk)
+    if since is not None:
+        chunk = chunk[chunk[datecol].dt.year >= since]
+        counts[f'since {since}'] = len(chunk)
+    if changed is not None:
+        chunk = chunk[chunk.filerIdent.isin(changed)]
+        counts['changed filers'] = len(chunk)
+    return chunk, counts
+
+
+
+def clean_chunks(zf, members, filers, cols, datecols, chunksize=None, changed=None, memory=False, since=None):
+    """
+    Yields (member, filer idents, row counts, cleaned df, memory, stages) for each file or chunk of members, filtered by filter_rows
+    before merging and cleaning. filer idents are those of the chunk's rows before filtering.
+    If memory, memory is a dict of df sizes in bytes after each stage, else None. stages times reading, filtering, merging and cleaning the chunk.
+    """
+    chunks = read_vardata(zf, members, cols, chunksize)
+    while True:
+        stages = Stages()
+        with stages.stage('read_csv') as stage:
+            member, chunk = next(chunks, (None, None))
+            stage['rows_out'] = len(chunk) if chunk is not None else 0
+        if chunk is None:
+            return
+        idents = chunk.filerIdent.dropna().unique()
+        sizes = {'read': chunk.memory_usage(deep=True).sum()} if memory else None
+        with stages.stage('parse dates', len(chunk)):
+            chunk = parse_date_cols(chunk, datecols)
+        with stages.stage('filter', len(chunk)) as stage:
+            chunk, counts = filter_rows(chunk, datecols[-1], since, changed)
+            stage['rows_out'] = len(chunk)
+        with stages.stage('merge', len(chunk)) as stage:
+            data = chunk.merge(filers, on='filerIdent', how='left')
+            stage['rows_out'] = len(data)
+        if memory:
+            sizes['merged'] = data.memory_usage(deep=True).sum()
+        data = clean_vardata(data, stages)
+        if memory:
+            sizes['cleaned'] = data.memory_usage(deep=True).sum()
+        counts['exported'] = len(data)
+        yield member, idents, counts, data, sizes, stages
 
-    # Downloading data
-    for id, group in data.groupby(data.filer_ident):
-        group.to_csv(f'{os.getcwd()}/data/processed/{var}/{var}_{id}.csv', index=False)
-        print('\tDonwloaded', id, ' '*80, end='\r')
 
 
+# Zip file and filers df of a pool worker, set once per process by init_worker
+worker_state = {}
 
-def clean_and_export_cover(zf):
+
+
+def init_worker(zippath, filers):
+    worker_state['zf'] = open_zip(zippath)
+    worker_state['filers'] = filers
+
+
+
+def clean_member(member, spill, cols, datecols, chunksize, changed, memory, since):
+    # Cleans member in a pool worker, pickling each chunk's result to its own file in spill as soon as it is cleaned; returns the paths in chunk order
+    paths = []
+    for result in clean_chunks(worker_state['zf'], [member], worker_state['filers'], cols, datecols, chunksize, changed, memory, since):
+        fd, path = tempfile.mkstemp(suffix='.pkl', dir=spill)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        paths.append(path)
+    return paths
+
+
+
+def load_chunks(paths):
+    # Yields the chunk results pickled by clean_member one at a time, deleting each file once loaded
+    for path in paths:
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+        os.remove(path)
+        yield result
+
+
+
+def clean_chunks_parallel(pool, workers, members, cols, datecols, chunksize=None, changed=None, memory=False, since=None):
+    """
+    Same as clean_chunks, but each member is cleaned in a pool worker. Results are yielded in member order, so exported files
+    are identical to the serial ones, and at most workers + 1 members are pending at once. Workers spill each cleaned chunk
+    to a temp file instead of returning whole members, so the parent holds one chunk at a time as in the serial path,
+    at the cost of disk space for the pending members' cleaned chunks.
+    """
+    with tempfile.TemporaryDirectory() as spill:
+        pending = deque()
+        for member in members:
+            pending.append(pool.submit(clean_member, member, spill, cols, datecols, chunksize, changed, memory, since))
+            if len(pending) > workers:
+                yield from load_chunks(pending.popleft().result())
+        while pending:
+            yield from load_chunks(pending.popleft().result())
+
+
+
+def clean_and_export_vardata(var, zf, filers, filenames, cols, datecols, args, manifest=None, stale=None, pool=None, store=None, stages=None):
+    """
+    Given series of filenames or filename patterns for a var (e.g. contributions), 
+    reads each file (in chunks of at most args.chunksize rows, if set), merges and cleans it with filers df, and appends it to per-filer files,
+    so that only one file or chunk is in memory at a time. If a pool is passed, files are cleaned by its args.workers workers.
+    Each per-filer file also gets a {var}_{id}_view projection without the joined filer and office cols,
+    and the var's counterparties are indexed across filers in {var}_counterparty_index.parquet.
+    If args.parquet, each per-filer CSV also gets a Parquet copy.
+    If a store is passed, the view rows and aggregates are also loaded into its {var}, {var}_monthly, {var}_counterparties and {var}_top tables.
+    If a manifest is passed (incremental mode), only filers with rows in changed files (before or after the change) or in stale are rebuilt,
+    only files whose content changed are rewritten, and the files of rebuilt filers left without rows are deleted.
+    Each stage is timed in stages (if passed) under {var}/, including those of chunks cleaned by pool workers.
+    """
+
+    print(f'Cleaning and exporting {var}', " "*80)
+    if stages is None:
+        stages = Stages()
+
+    members = list_members(zf, filenames)
+    outdir = f'{os.getcwd()}/data/processed/{var}'
+    changed = None
+    if manifest is not None:
+        changed = changed_filers(zf, var, members, manifest, stale)
+        if changed is not None and len(changed) == 0:
+            print('\tNo changes since last run', " "*80)
+            return
+        staging = tempfile.TemporaryDirectory()
+        outdir = staging.name
+
+    chunksize = args.chunksize or None
+    since = window_start(args.years)
+    if pool is None:
+        cleaned = clean_chunks(zf, members, filers, cols, datecols, chunksize, changed, args.memory_report, since)
+    else:
+        cleaned = clean_chunks_parallel(pool, args.workers, members, cols, datecols, chunksize, changed, args.memory_report, since)
+
+    writer = PartitionWriter(var, outdir, args.writer_threads, parquet=args.parquet)
+    views = PartitionWriter(var, outdir, args.writer_threads, suffix='_view', parquet=args.parquet)
+    prefix = snake_case([col for col in cols if col.endswith('NameFirst')][0].split('NameFirst')[0])
+    tables = {var: [['filer_ident', snake_case(datecols[-1])], [snake_case(datecols[-1])], [f'{prefix}_name']],
+        f'{var}_monthly': [['filer_ident']], f'{var}_counterparties': [['filer_ident'], [f'{prefix}_name']], f'{var}_top': [['filer_ident']]}
+    if store is not None:
+        for table in tables:
+            store.clear(table, changed)
+    aggregator = Aggregator(prefix, snake_case(datecols[-1]), snake_case([col for col in cols if col.endswith('Amount')][0]), filers.filerIdent.dropna())
+    funnel = {}
+    memory = {}
+    member_filers = {}
+    for member, idents, counts, data, sizes, chunk_stages in cleaned:
+        member_filers.setdefault(member, set()).update(idents)
+        stages.merge(chunk_stages, prefix=f'{var}/')
+        for stage, count in counts.items():
+            funnel[stage] = funnel.get(stage, 0) + count
+        for stage, size in (sizes or {}).items():
+            memory[stage] = max(memory.get(stage, 0), size)
+        with stages.stage(f'{var}/export', len(data)):
+            writer.write(data)
+            views.write(data[view_cols(data.columns)])
+        if store is not None:
+            with stages.stage(f'{var}/store', len(data)):
+                store.write(var, data[view_cols(data.columns)])
+        with stages.stage(f'{var}/aggregate', len(data)):
+            aggregator.add(data)
+        print(f'\tProcessed {funnel["read"]:,} rows', " "*80, end='\r')
+    with stages.stage(f'{var}/export'):
+        writer.close()
+        views.close()
+    print('\tExporting aggregates', " "*80, end='\r')
+    with stages.stage(f'{var}/export aggregates'):
+        aggregator.export(var, outdir, args.writer_threads, store)
+    if store is not None:
+        print('\tIndexing store tables', " "*80, end='\r')
+        with stages.stage(f'{var}/store'):
+            for table, indexes in tables.items():
+                store.index(table, indexes)
+    print('\tExporting counterparty index', " "*80, end='\r')
+    with stages.stage(f'{var}/counterparty index') as stage:
+        stage['rows_out'] = sum(len(table) for table in aggregator.index)
+        export_counterparty_index(aggregator.index, f'{outdir}/{var}_counterparty_index.parquet', f'{os.getcwd()}/data/processed/{var}/{var}_counterparty_index.parquet', changed)
+    rows = funnel.get('read', 0)
+    print('\tRows: ' + ' -> '.join(f'{stage} {count:,}' for stage, count in funnel.items()), " "*80)
+    if memory:
+        print('\tLargest chunk in memory (MB): ' + ', '.join(f'{stage} {size / 1024**2:,.1f}' for stage, size in memory.items()), " "*80)
+    written = writer.written
+
+    if args.parquet:
+        print('\tWriting Parquet files', " "*80, end='\r')
+        with stages.stage(f'{var}/parquet'):
+            writer.write_parquet()
+            views.write_parquet()
+
+    if manifest is not None:
+        rebuilt = len(written)
+        with stages.stage(f'{var}/publish'):
+            removed = remove_stale_files(outdir, f'{os.getcwd()}/data/processed/{var}', var, changed, manifest)
+            written = publish_files(outdir, f'{os.getcwd()}/data/processed/{var}', manifest)
+            staging.cleanup()
+        record_members(zf, var, members, manifest, member_filers)
+        print(f'\tRead {rows:,} rows, rebuilt {rebuilt:,} files, exported {written:,} changed files, deleted {removed:,} files of filers without rows', " "*80)
+    else:
+        print(f'\tRead {rows:,} rows, exported {len(written):,} files', " "*80)
+
+
+
+def clean_and_export_cover(zf, args, manifest=None, store=None, stages=None):
+    """
+    Exports each filer's balance series to balance/balance_{id}.csv and every filer's latest balance and change to balance/balance_summary.csv.
+    If a manifest is passed (incremental mode), only filers whose cover rows changed since the last run are recomputed and exported,
+    the summary rows of the other filers being kept from the last run's summary, and the files of filers left without reports are deleted.
+    """
+    if stages is None:
+        stages = Stages()
+
+    # Skipping unchanged data
+    if manifest is not None and manifest['vars'].get('balance') == ['cover.csv'] and \
+        manifest['members'].get('cover.csv') == member_checksum(zf, 'cover.csv'):
+        print('\tNo changes to cover.csv since last run', " "*80)
+        return
 
     # Loading data
-    cover = pd.read_csv(zf.open('cover.csv'), usecols=cover_cols, parse_dates = ['receivedDt'], dtype={'filerIdent': str, 'periodStartDt': str, 'periodEndDt': str})\
-    .dropna(axis=1,how='all').sort_values(['receivedDt', 'timelyCorrectionFlag'], ascending=False)
-    
+    with stages.stage('cover/read_csv') as stage:
+        cover = pd.read_csv(zf.open('cover.csv'), usecols=cover_cols, dtype={'filerIdent': str, 'receivedDt': str, 'periodStartDt': str, 'periodEndDt': str})
+        stage['rows_out'] = len(cover)
+
+    # Keeping the rows of filers whose reports changed since the last run
+    summary_path = f'{os.getcwd()}/data/processed/balance/balance_summary.csv'
+    hashes = cover_hashes(cover) if manifest is not None else None
+    changed = None
+    if manifest is not None and manifest['vars'].get('balance') == ['cover.csv'] and 'balance' in manifest and os.path.exists(summary_path):
+        with stages.stage('cover/filter', len(cover)) as stage:
+            changed = changed_hashes(hashes, manifest['balance'])
+            cover = cover[cover.filerIdent.isin(changed)]
+            stage['rows_out'] = len(cover)
+
+    # Parsing dates (after hashing, so hashes are of the raw strs)
+    with stages.stage('cover/parse dates', len(cover)):
+        cover = cover.assign(**{col: parse_dates(cover[col]) for col in ['receivedDt', 'periodStartDt', 'periodEndDt']})
+
     # Filering and calculating balance
-    cover = cover[cover.infoOnlyFlag == 'N']
-    cover = cover.drop_duplicates(['filerIdent', 'receivedDt'], keep='first')
-    for col in ['periodStartDt', 'periodEndDt']:
-            cover[col] = pd.to_datetime(cover[col], errors='coerce')
-    cover['balance'] = cover[['unitemizedContribAmount', 'totalContribAmount', 'contribsMaintainedAmount', 'totalInterestEarnedAmount']].fillna(0).sum(axis=1) - \
-            cover[['unitemizedExpendAmount', 'totalExpendAmount', 'loanBalanceAmount', 'unitemizedLoanAmount']].fillna(0).sum(axis=1)
-    cover = cover[['filerIdent', 'filerName', 'receivedDt', 'periodStartDt', 'periodEndDt', 'balance']]
+    with stages.stage('cover/clean', len(cover)) as stage:
+        cover = balance_series(cover)
+        stage['rows_out'] = len(cover)
 
     # Merging with filers
     cover.columns = [re.sub('(?<!^)(?=[A-Z])', '_', col).lower() for col in cover.columns]
 
-    # Downloading data
-    for id, group in cover.groupby(cover.filer_ident):
-        group.to_csv(f'{os.getcwd()}/data/processed/balance/balance_{id}.csv', index=False)
-        print('\tDonwloaded', id, ' '*80, end='\r')
-
-
+    # Summarizing latest balances
+    with stages.stage('cover/summary', len(cover)) as stage:
+        summary = balance_summary(cover)
+        if changed is not None:
+            previous = pd.read_csv(summary_path, dtype={'filer_ident': str}, parse_dates=['received_dt', 'previous_received_dt'], float_precision='round_trip')
+            summary = pd.concat([previous[~previous.filer_ident.isin(changed)], summary]).sort_values('filer_ident').reset_index(drop=True)
+        stage['rows_out'] = len(summary)
 
-def main():
+    # Downloading data
+    outdir = f'{os.getcwd()}/data/processed/balance'
+    if manifest is not None:
+        staging = tempfile.TemporaryDirectory()
+        outdir = staging.name
+    with stages.stage('cover/export', len(cover)):
+        writer = PartitionWriter('balance', outdir, args.writer_threads, parquet=args.parquet)
+        writer.write(cover)
+        writer.close()
+        summary.to_csv(f'{outdir}/balance_summary.csv', index=False)
+    if store is not None:
+        with stages.stage('cover/store', len(cover)):
+            store.clear('balance', changed)
+            store.write('balance', cover)
+            store.index('balance', [['filer_ident', 'received_dt']])
+            store.clear('balance_summary')
+            store.write('balance_summary', summary)
+            store.index('balance_summary', [['filer_ident']])
+    if args.parquet:
+        with stages.stage('cover/parquet'):
+            writer.write_parquet()
+            summary.to_parquet(f'{outdir}/balance_summary.parquet', index=False)
+
+    if manifest is not None:
+        with stages.stage('cover/publish'):
+            remove_stale_files(outdir, f'{os.getcwd()}/data/processed/balance', 'balance', changed, manifest)
+            written = publish_files(outdir, f'{os.getcwd()}/data/processed/balance', manifest)
+            staging.cleanup()
+        record_members(zf, 'balance', ['cover.csv'], manifest)
+        manifest['balance'] = hashes
+        if changed is not None:
+            print(f'\tRecomputed balances of {len(writer.written):,} filers, exported {written:,} changed balance files', " "*80)
+        else:
+            print(f'\tExported {written:,} changed balance files', " "*80)
+
+
+
+def window_start(years):
+    # First year kept by a rolling window of years (e.g. 2017 for 5 years in 2022, like the app), None for all years
+    if years:
+        return date.today().year - years
+    return None
+
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Downloads, cleans and exports TEC campaign finance data')
+    parser.add_argument('--url', default='https://www.ethics.state.tx.us/data/search/cf/TEC_CF_CSV.zip',
+        help='URL of the TEC campaign finance zip')
+    parser.add_argument('--zip',
+        help='Process this local TEC zip (e.g. one written by synthetic.py) instead of downloading --url')
+    parser.add_argument('--cache-dir', default=f'{os.getcwd()}/.cache',
+        help='Directory the zip is downloaded to and reused from when unchanged (default: .cache)')
+    parser.add_argument('--chunksize', type=int, default=250000,
+        help='Max rows of a contribs/expend/loans file held in memory at once; 0 loads each file whole (default: 250000)')
+    parser.add_argument('--workers', type=int, default=1,
+        help='Number of processes cleaning contribs/expend/loans files in parallel (default: 1)')
+    parser.add_argument('--writer-threads', type=int, default=4,
+        help='Number of threads writing per-filer files (default: 4)')
+    parser.add_argument('--parquet', action='store_true',
+        help='Also write a Parquet copy of every per-filer contribs/expend/loans/balance CSV')
+    parser.add_argument('--memory-report', action='store_true',
+        help='Report the in-memory size of the largest chunk after reading, merging and cleaning')
+    parser.add_argument('--years', type=int, default=0,
+        help='Only keep contribs/expend/loans dated in the last N years (plus the current one); 0 keeps all years (default: 0)')
+    parser.add_argument('--incremental', action='store_true',
+        help='Only rebuild filers whose source rows changed since the last run and only rewrite changed files (tracked in data/processed/manifest.json)')
+    parser.add_argument('--store',
+        help='Also load transactions, aggregates, balance and filers into an indexed SQLite database at this path (e.g. data/processed/tec.sqlite)')
+    parser.add_argument('--stats', default=f'{os.getcwd()}/data/documentation/etl_stats.jsonl',
+        help='File the run\'s per-stage wall time, CPU time, rows and peak memory are appended to as one JSON line (default: data/documentation/etl_stats.jsonl)')
+    return parser.parse_args(argv)
+
+
+
+def main(args):
 
     startTime = time.time()
+    startCpu = time.process_time()
+    stages = Stages()
+    manifest = load_manifest() if args.incremental else None
+    options = {'parquet': args.parquet, 'since': window_start(args.years), 'aggregates': True, 'views': True, 'counterparty_index': True, 'store': args.store}
+    if manifest is not None and (manifest.get('options') != options or (args.store and not os.path.exists(args.store))):
+        # Output formats or year window changed (or the store is missing), so every var is rebuilt
+        manifest['vars'] = {}
 
     # Downloading and extracting file
     print('Updating data')
-    zipfile = BytesIO(requests.get('https://www.ethics.state.tx.us/data/search/cf/TEC_CF_CSV.zip').content)
-    zf = ZipFile(zipfile)
+    zippath = args.zip or f'{args.cache_dir}/TEC_CF_CSV.zip'
+    if not args.zip:
+        with stages.stage('download'):
+            download_zip(args.url, zippath)
+    zf = open_zip(zippath)
                 
     # Loading filer data
-    filers = make_sorted_cols(clean_filer_data(zf.open('filers.csv')))
-    filers = filers[(filers['filerName'].str.lower().str.contains('use, do not|not to be use|do not') == False)]
-    filers.to_csv(f'{os.getcwd()}/data/processed/filers.csv', index=False)
-    filers.filerEffStartDt = pd.to_datetime(filers.filerEffStartDt)
-    filers = filers.sort_values('filerEffStartDt').drop_duplicates(subset=['filerIdent'], keep='last')
+    filers = make_sorted_cols(clean_filer_data(zf.open('filers.csv'), stages))
+    with stages.stage('filers/filter', len(filers)) as stage:
+        filers = filers[(filers['filerName'].str.lower().str.contains('use, do not|not to be use|do not') == False)]
+        latest = filers.assign(filerEffStartDt=pd.to_datetime(filers.filerEffStartDt))\
+            .sort_values('filerEffStartDt').drop_duplicates(subset=['filerIdent'], keep='last')
+        stage['rows_out'] = len(latest)
+    with stages.stage('filers/export', len(filers)):
+        if manifest is not None:
+            with tempfile.TemporaryDirectory() as staging:
+                filers.to_csv(f'{staging}/filers.csv', index=False)
+                export_filer_index(filers, filer_partitions(latest), staging)
+                publish_files(staging, f'{os.getcwd()}/data/processed', manifest)
+        else:
+            filers.to_csv(f'{os.getcwd()}/data/processed/filers.csv', index=False)
+            export_filer_index(filers, filer_partitions(latest), f'{os.getcwd()}/data/processed')
+    filers = latest
+    stale = stale_filers(filers, manifest) if manifest is not None else None
+
+    # Loading filers into the store, rebuilt from scratch unless updating an incremental run's tables
+    store = None
+    if args.store:
+        with stages.stage('filers/store', len(filers)):
+            store = Store(args.store, fresh=manifest is None or not manifest['vars'])
+            store.clear('filers')
+            store.write('filers', filers.rename(columns=snake_case))
+            store.index('filers', [['filer_ident']])
 
     # Cleaning and downloading cover data
-    clean_and_export_cover(zf)
+    clean_and_export_cover(zf, args, manifest, store, stages)
 
     # Processing and downloading data
-    clean_and_export_vardata('contribs', zf, filers, ['contribs_*.csv'], contribs_cols, ['receivedDt', 'contributionDt']) # Contributions
-    clean_and_export_vardata('expend', zf, filers, ['expend_*.csv'], expend_cols, ['receivedDt', 'expendDt']) # Expenditures
-    clean_and_export_vardata('loans', zf, filers, ['loans.csv'], loans_cols, ['receivedDt', 'loanDt']) # Loans
+    pool = ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(zippath, filers)) if args.workers > 1 else None
+    clean_and_export_vardata('contribs', zf, filers, ['contribs_*.csv'], contribs_cols, ['receivedDt', 'contributionDt'], args, manifest, stale, pool, store, stages) # Contributions
+    clean_and_export_vardata('expend', zf, filers, ['expend_*.csv'], expend_cols, ['receivedDt', 'expendDt'], args, manifest, stale, pool, store, stages) # Expenditures
+    clean_and_export_vardata('loans', zf, filers, ['loans.csv'], loans_cols, ['receivedDt', 'loanDt'], args, manifest, stale, pool, store, stages) # Loans
+    if pool is not None:
+        pool.shutdown()
+    if store is not None:
+        store.close()
+
+    # Saving manifest for the next incremental run
+    if manifest is not None:
+        manifest['filers'] = filer_hashes(filers)
+        manifest['options'] = options
+        save_manifest(manifest)
 
     # Updating last update txt file
     timezone_offset = -5.0
@@ -211,9 +919,23 @@ def main():
     with open(f'{os.getcwd()}/data/documentation/last_update.txt', 'w') as f:
         f.write(last_update)
 
+    zf.close()
+
     executionTime = (time.time() - startTime)
+    stages.report()
     print('Execution time in seconds: ' + str(executionTime))
+    # Workers' peaks come from their stages, since ru_maxrss of exited children misses the peaks of stages they reset
+    peak, worker_peak = process_peak_mb(), max(stages.worker_peak or 0, peak_rss_mb(resource.RUSAGE_CHILDREN))
+    print('Peak memory (RSS) in MB: ' + str(round(peak, 1)))
+    if pool is not None:
+        print('Peak worker memory (RSS) in MB: ' + str(round(worker_peak, 1)))
+
+    # Saving stage stats for tracking across runs
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    stages.save(args.stats, args={key: value for key, value in vars(args).items() if key != 'stats'}, wall_s=round(executionTime, 3),
+        cpu_s=round(time.process_time() - startCpu, 3), worker_cpu_s=round(children.ru_utime + children.ru_stime, 3),
+        peak_rss_mb=round(peak, 1), worker_peak_rss_mb=round(worker_peak, 1) if pool is not None else None)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main(parse_args())
\ No newline at end of file